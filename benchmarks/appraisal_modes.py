@@ -0,0 +1,100 @@
+"""
+Leave-one-out comparison of the appraisal modes.
+
+Every listing of the dataset is appraised with the neighbours of its own brand/model group, leaving the listing
+itself out, and the prediction is compared with its real Price_EUR. The umap embedding is fitted once per group
+(refitting it for every held-out listing would take days), so only the neighbour search leaves the listing out.
+Latency is measured with warm models through `predict_price`, the same path the chatbot uses.
+
+Run from the repository root:
+    python -m benchmarks.appraisal_modes
+    python -m benchmarks.appraisal_modes --modes scaled_knn --latency-samples 500
+"""
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from webpages.pages_util.price_advisor import (APPRAISAL_MODES, COMPARED_PRICE, N_NEIGHBORS, get_appraisal_model,
+                                               predict_price)
+from webpages.pages_util.listing_store import read_dataset
+from webpages.pages_util.util import dataset_path
+
+
+def leave_one_out(df, mode):
+    """Return the absolute errors of every listing that could be appraised and the time spent fitting."""
+    errors = []
+    real_prices = []
+    fit_seconds = 0.0
+
+    for (brand, model), group in df.groupby(["Brand", "Model"], sort=False, observed=True):
+        group = group.dropna(subset=["Year", "Kilometers", "Power_hp", "Price_EUR"])
+        if len(group) <= N_NEIGHBORS:
+            continue
+
+        start = time.perf_counter()
+        try:
+            appraisal_model = get_appraisal_model(brand, model, mode)
+        except Exception:
+            continue
+        fit_seconds += time.perf_counter() - start
+
+        # Appraise the listings as new cars, asking for one extra neighbour to leave the listing itself out
+        cars = group.assign(Compared_Price=COMPARED_PRICE)
+        try:
+            distances, listing_ids, prices = appraisal_model.kneighbors(cars, n_neighbors=N_NEIGHBORS + 1)
+        except Exception:
+            continue
+
+        keep = listing_ids != group.index.to_numpy()[:, None]
+        keep[keep.all(axis=1), -1] = False
+        predicted = prices[keep].reshape(len(group), N_NEIGHBORS).mean(axis=1)
+
+        real = group["Price_EUR"].to_numpy(dtype=float)
+        errors.append(np.abs(predicted - real))
+        real_prices.append(real)
+
+    return np.concatenate(errors), np.concatenate(real_prices), fit_seconds
+
+
+def latency(df, mode, samples, seed=0):
+    """Time warm `predict_price` calls on a sample of listings, in milliseconds."""
+    sample = df.sample(min(samples, len(df)), random_state=seed)
+    timings = []
+    for _, car in sample.iterrows():
+        start = time.perf_counter()
+        predict_price(brand=car["Brand"], model=car["Model"], year=car["Year"],
+                      displacement_cm3=car["Displacement_cm3"], power_hp=car["Power_hp"],
+                      gear_type=car["Gear_Type"], kilometers=car["Kilometers"], fuel=car["Fuel"],
+                      condition=car["Condition"], mode=mode)
+        timings.append((time.perf_counter() - start) * 1000)
+    return np.array(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--modes", nargs="+", default=list(APPRAISAL_MODES), choices=list(APPRAISAL_MODES))
+    parser.add_argument("--latency-samples", type=int, default=200)
+    args = parser.parse_args()
+
+    df = read_dataset(dataset_path())
+
+    rows = []
+    for mode in args.modes:
+        errors, real_prices, fit_seconds = leave_one_out(df, mode)
+        timings = latency(df, mode, args.latency_samples)
+        rows.append({"mode": mode,
+                     "appraised": len(errors),
+                     "coverage": len(errors) / len(df),
+                     "MAE (€)": errors.mean(),
+                     "MAPE": (errors / real_prices).mean(),
+                     "fit/load (s)": fit_seconds,
+                     "p50 (ms)": np.percentile(timings, 50),
+                     "p95 (ms)": np.percentile(timings, 95)})
+
+    print(pd.DataFrame(rows).set_index("mode").to_markdown(floatfmt=".3f"))
+
+
+if __name__ == "__main__":
+    main()
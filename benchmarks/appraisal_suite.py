@@ -0,0 +1,205 @@
+"""
+Appraisal benchmark and regression suite.
+
+A held-out sample of car_dataset.csv is appraised with models fitted on the remaining listings, and on synthetic
+datasets built by replicating those listings (with jittered features) 10x and 100x. Each scenario runs in a fresh
+process with its own models directory, and records:
+    - cold latency: the first appraisal of the process and the whole first pass, fitting the models as needed
+    - warm latency: p50/p95 of a second pass over the sample
+    - peak RSS of the process
+    - MAE/MAPE against the real Price_EUR of the held-out listings
+
+The results are written to a JSON report and compared with the stored baseline. The script exits with status 1
+when the warm p95 latency or the MAE regress beyond the tolerances.
+
+Run from the repository root:
+    python -m benchmarks.appraisal_suite
+    python -m benchmarks.appraisal_suite --scales 1 10 --modes scaled_knn
+    python -m benchmarks.appraisal_suite --update-baseline
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from webpages.pages_util.listing_store import read_dataset
+from webpages.pages_util.util import dataset_path
+
+APPRAISAL_MODES = ["umap", "scaled_knn"]
+REPORT_PATH = "benchmarks/appraisal_report.json"
+BASELINE_PATH = "benchmarks/appraisal_baseline.json"
+
+
+def peak_rss_mb():
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024 ** 2 if sys.platform == "darwin" else peak / 1024
+
+
+def make_synthetic(df, scale, seed=0):
+    """Replicate the listings `scale` times, jittering the numeric features of the copies."""
+    if scale == 1:
+        return df
+
+    rng = np.random.default_rng(seed)
+    copies = [df]
+    for _ in range(scale - 1):
+        copy = df.copy()
+        copy["Year"] = copy["Year"] + rng.integers(-1, 2, len(copy))
+        copy["Kilometers"] = (copy["Kilometers"] * rng.normal(1, 0.1, len(copy))).round().clip(lower=0)
+        copy["Power_hp"] = (copy["Power_hp"] * rng.normal(1, 0.02, len(copy))).round()
+        copy["Price_EUR"] = (copy["Price_EUR"] * rng.normal(1, 0.05, len(copy))).round()
+        copies.append(copy)
+
+    synthetic = pd.concat(copies, ignore_index=True)
+    synthetic.index.name = df.index.name
+    return synthetic
+
+
+def appraise(estimate_price, cars, mode):
+    """Appraise every car, returning the predictions (NaN when impossible) and the latency of each call."""
+    predictions = []
+    timings = []
+    for _, car in cars.iterrows():
+        start = time.perf_counter()
+        try:
+            price = estimate_price(brand=car["Brand"], model=car["Model"], year=car["Year"],
+                                   displacement_cm3=car["Displacement_cm3"], power_hp=car["Power_hp"],
+                                   gear_type=car["Gear_Type"], kilometers=car["Kilometers"], fuel=car["Fuel"],
+                                   condition=car["Condition"], mode=mode)
+        except Exception:
+            price = np.nan
+        timings.append((time.perf_counter() - start) * 1000)
+        predictions.append(price)
+    return np.array(predictions, dtype=float), np.array(timings)
+
+
+def run_scenario(held_out_path, mode):
+    """Measure one scenario, the dataset and models directory are set through the environment."""
+    start = time.perf_counter()
+    from webpages.pages_util.price_advisor import estimate_price
+    import_seconds = time.perf_counter() - start
+
+    held_out = pd.read_csv(held_out_path, index_col=0)
+
+    cold_predictions, cold_timings = appraise(estimate_price, held_out, mode)
+    predictions, timings = appraise(estimate_price, held_out, mode)
+
+    appraised = ~np.isnan(predictions)
+    real = held_out["Price_EUR"].to_numpy(dtype=float)
+    errors = np.abs(predictions[appraised] - real[appraised])
+
+    return {"import_s": import_seconds,
+            "cold_first_ms": cold_timings[0],
+            "cold_total_s": cold_timings.sum() / 1000,
+            "warm_p50_ms": float(np.percentile(timings, 50)),
+            "warm_p95_ms": float(np.percentile(timings, 95)),
+            "peak_rss_mb": peak_rss_mb(),
+            "appraised": int(appraised.sum()),
+            "mae": float(errors.mean()) if len(errors) else None,
+            "mape": float((errors / real[appraised]).mean()) if len(errors) else None}
+
+
+def spawn_scenario(dataset_path, held_out_path, models_dir, mode):
+    env = dict(os.environ, AUTOMENTOR_DATASET_PATH=dataset_path, AUTOMENTOR_APPRAISAL_MODELS_DIR=models_dir)
+    result = subprocess.run([sys.executable, "-m", "benchmarks.appraisal_suite", "--run-scenario", held_out_path,
+                             "--modes", mode], env=env, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"Scenario failed:\n{result.stderr}")
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def find_regressions(scenarios, baseline, latency_tolerance, mae_tolerance):
+    regressions = []
+    for name, metrics in scenarios.items():
+        if name not in baseline:
+            continue
+        reference = baseline[name]
+        for metric, tolerance in [("warm_p95_ms", latency_tolerance), ("mae", mae_tolerance)]:
+            if metrics.get(metric) is None or reference.get(metric) is None:
+                continue
+            if metrics[metric] > reference[metric] * (1 + tolerance):
+                regressions.append(f"{name}: {metric} {metrics[metric]:.2f} > baseline {reference[metric]:.2f} "
+                                   f"(+{tolerance:.0%} allowed)")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sample", type=int, default=200, help="number of held-out listings")
+    parser.add_argument("--scales", type=int, nargs="+", default=[1, 10, 100])
+    parser.add_argument("--modes", nargs="+", default=APPRAISAL_MODES, choices=APPRAISAL_MODES)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--report", default=REPORT_PATH)
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--update-baseline", action="store_true", help="store this run as the new baseline")
+    parser.add_argument("--latency-tolerance", type=float, default=0.25)
+    parser.add_argument("--mae-tolerance", type=float, default=0.05)
+    parser.add_argument("--run-scenario", metavar="HELD_OUT_CSV", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_scenario:
+        print(json.dumps(run_scenario(args.run_scenario, args.modes[0])))
+        return
+
+    df = read_dataset(dataset_path())
+    held_out = df.sample(min(args.sample, len(df)), random_state=args.seed)
+    train = df.drop(held_out.index)
+
+    scenarios = {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        held_out_path = os.path.join(tmp_dir, "held_out.csv")
+        held_out.to_csv(held_out_path)
+
+        for scale in args.scales:
+            dataset_path = os.path.join(tmp_dir, f"car_dataset_{scale}x.csv")
+            make_synthetic(train, scale, args.seed).to_csv(dataset_path)
+
+            for mode in args.modes:
+                name = f"{mode}@{scale}x"
+                models_dir = os.path.join(tmp_dir, f"models_{name}")
+                print(f"Running {name} ({len(train) * scale} listings)...", file=sys.stderr)
+                scenarios[name] = spawn_scenario(dataset_path, held_out_path, models_dir, mode)
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)["scenarios"]
+    regressions = find_regressions(scenarios, baseline, args.latency_tolerance, args.mae_tolerance)
+
+    report = {"created": time.strftime("%Y-%m-%d %H:%M:%S"),
+              "dataset_rows": len(df),
+              "sample": len(held_out),
+              "scenarios": scenarios,
+              "regressions": regressions}
+    with open(args.report, "w") as f:
+        json.dump(report, f, indent=2)
+
+    print(pd.DataFrame(scenarios).T.to_markdown(floatfmt=".2f"))
+    print(f"\nReport written to {args.report}")
+
+    if args.update_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Baseline updated: {args.baseline}")
+    elif not baseline:
+        print(f"No baseline found at {args.baseline}, run with --update-baseline to store one.")
+    elif regressions:
+        print("\nRegressions:\n" + "\n".join(regressions))
+        sys.exit(1)
+    else:
+        print("No regressions against the baseline.")
+
+
+if __name__ == "__main__":
+    main()
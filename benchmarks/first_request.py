@@ -0,0 +1,97 @@
+"""
+Latency of the first appraisal of a fresh server process, with and without the warm-up of warmup.py.
+
+Each scenario runs in a fresh process. The process appraises the same cars through the appraisal pool, as the chatbot
+does, and records the latency of the first appraisal and the p50 of the following ones. The scenarios are:
+    - no warm-up: the first appraisal spawns the pool workers and compiles umap's numba functions
+    - warm-up: the warm-up runs to completion first, compiling into an empty numba cache
+    - warm-up, numba cache on disk: the same, as a restarted server with the cache left by the previous scenario
+
+The appraisal models of the cars are fitted and saved before the scenarios, so no scenario pays for fitting them.
+
+Run from the repository root:
+    python -m benchmarks.first_request
+    python -m benchmarks.first_request --requests 50
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+CARS = [
+    {"brand": "BMW", "model": "520", "year": 2019, "displacement_cm3": 2000, "power_hp": 190, "gear_type": "Manual",
+     "kilometers": 150000, "fuel": "Diesel", "condition": "Used"},
+    {"brand": "BMW", "model": "520", "year": 2015, "displacement_cm3": 2000, "power_hp": 184, "gear_type": "Automatic",
+     "kilometers": 210000, "fuel": "Diesel", "condition": "Used"},
+]
+
+
+def run_scenario(warm_up, requests):
+    # Imported here so NUMBA_CACHE_DIR, set by the parent for this process, applies before numba is imported
+    from webpages.pages_util.appraisal_pool import appraisal_pool
+    from webpages.pages_util.price_advisor import predict_price
+
+    start = time.perf_counter()
+    warm_up_s = None
+    if warm_up:
+        from webpages.pages_util.warmup import get_warmup
+        warmup = get_warmup()
+        warmup.wait()
+        warm_up_s = time.perf_counter() - start
+
+    timings = []
+    for i in range(requests):
+        request_start = time.perf_counter()
+        asyncio.run(appraisal_pool.run(predict_price, **CARS[i % len(CARS)]))
+        timings.append((time.perf_counter() - request_start) * 1000)
+    appraisal_pool.shutdown()
+
+    return {"warm-up (s)": warm_up_s,
+            "first (ms)": timings[0],
+            "p50 of the next (ms)": np.percentile(timings[1:], 50),
+            "hundredth (ms)": timings[min(99, len(timings) - 1)]}
+
+
+def spawn_scenario(numba_cache_dir, warm_up, requests):
+    env = dict(os.environ, NUMBA_CACHE_DIR=numba_cache_dir)
+    command = [sys.executable, "-m", "benchmarks.first_request", "--run-scenario", "--requests", str(requests)]
+    if warm_up:
+        command.append("--warm-up")
+    result = subprocess.run(command, capture_output=True, text=True, env=env, check=True)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=100)
+    parser.add_argument("--run-scenario", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--warm-up", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_scenario:
+        print(json.dumps(run_scenario(args.warm_up, args.requests)))
+        return
+
+    from webpages.pages_util.price_advisor import get_appraisal_model
+    for car in CARS:
+        get_appraisal_model(car["brand"], car["model"])
+
+    rows = []
+    with tempfile.TemporaryDirectory() as no_warm_up_cache, tempfile.TemporaryDirectory() as numba_cache:
+        for name, cache_dir, warm_up in [("no warm-up", no_warm_up_cache, False),
+                                         ("warm-up", numba_cache, True),
+                                         ("warm-up, numba cache on disk", numba_cache, True)]:
+            rows.append({"scenario": name, **spawn_scenario(cache_dir, warm_up, args.requests)})
+
+    print(pd.DataFrame(rows).set_index("scenario").to_markdown(floatfmt=".1f"))
+
+
+if __name__ == "__main__":
+    main()
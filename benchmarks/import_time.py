@@ -0,0 +1,62 @@
+"""
+Cold start import-time breakdown of the app's entry point and pages.
+
+Each module is imported in a fresh interpreter with `python -X importtime`. The report gives the median import time
+over the runs and the top-level packages that took the longest to load. `main` renders the Home page in bare mode
+(Streamlit warns that it is not run with `streamlit run`), which is what a visitor waits for before the first page.
+
+Run from the repository root:
+    python -m benchmarks.import_time
+    python -m benchmarks.import_time --modules main webpages.chatbot --repeat 5
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+import numpy as np
+import pandas as pd
+
+DEFAULT_MODULES = ["main", "webpages.home", "webpages.account", "webpages.chatbot", "webpages.pages_util.agent",
+                   "webpages.pages_util.price_advisor"]
+
+
+def import_times(module):
+    """Cumulative import time in seconds of every module loaded by importing a module, its dependencies included."""
+    env = dict(os.environ, OPENAI_API_KEY=os.environ.get("OPENAI_API_KEY", "sk-import-time"))
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                            capture_output=True, text=True, env=env)
+    if result.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{result.stderr[-2000:]}")
+
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line.split("|")
+        times[name.strip()] = int(cumulative) / 1e6
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--modules", nargs="+", default=DEFAULT_MODULES)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--top", type=int, default=4, help="heaviest packages listed per module")
+    args = parser.parse_args()
+
+    rows = []
+    for module in args.modules:
+        runs = [import_times(module) for _ in range(args.repeat)]
+        total = np.median([times[module] for times in runs])
+        heaviest = sorted(((name, seconds) for name, seconds in runs[-1].items()
+                           if name != module and "." not in name), key=lambda item: -item[1])[:args.top]
+        rows.append({"module": module,
+                     "import (s)": total,
+                     "heaviest packages": ", ".join(f"{name} {seconds:.2f}s" for name, seconds in heaviest)})
+
+    print(pd.DataFrame(rows).set_index("module").to_markdown(floatfmt=".2f"))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+"""
+Multi-session load test of AutoMentorChatbot against the local OpenAI stand-in (benchmarks/openai_stub.py).
+
+Each simulated session creates its own AutoMentorChatbot and plays the conversations of use_cases.md through
+`generate_response`, one turn after the other. The sessions of a concurrency level run in parallel threads, like
+Streamlit script threads, or with --async as tasks of the shared agent event loop through `agenerate_response`, where
+waiting for the model holds no thread. For every level the report gives the turns per second, the p50/p95/max turn latency, the
+memory added per session and the failed turns.
+
+The response cache is disabled and brand questions use the lexical retriever, so every turn reaches the stand-in
+and no request leaves the machine.
+
+Run from the repository root:
+    python -m benchmarks.load_test
+    python -m benchmarks.load_test --concurrency 1 8 32 --latency-ms 800 --token-ms 20
+    python -m benchmarks.load_test --async --concurrency 16 64
+"""
+import argparse
+import asyncio
+import contextlib
+import gc
+import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from benchmarks.openai_stub import start_stub
+
+USE_CASES_PATH = "use_cases.md"
+
+
+def read_conversations(path=USE_CASES_PATH):
+    """The user messages of each use case, in order."""
+    with open(path, encoding="utf-8") as f:
+        sections = re.split(r"^## ", f.read(), flags=re.MULTILINE)[1:]
+    conversations = [re.findall(r'### User (?:Question|Answer):\s*\n"(.+?)"', section) for section in sections]
+    return [messages for messages in conversations if messages]
+
+
+def rss_mb():
+    """Resident memory of the process, in MB."""
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1024 ** 2
+
+
+def run_session(conversations):
+    from webpages.pages_util.agent import AutoMentorChatbot
+
+    chatbot = AutoMentorChatbot()
+    timings, errors = [], []
+    for conversation in conversations:
+        chatbot.agent_memory = []
+        for message in conversation:
+            start = time.perf_counter()
+            try:
+                chatbot.generate_response(message)
+            except Exception as e:
+                errors.append(repr(e))
+            timings.append(time.perf_counter() - start)
+    return chatbot, timings, errors
+
+
+async def arun_session(chatbot, conversations):
+    timings, errors = [], []
+    for conversation in conversations:
+        chatbot.agent_memory = []
+        for message in conversation:
+            start = time.perf_counter()
+            try:
+                await chatbot.agenerate_response(message)
+            except Exception as e:
+                errors.append(repr(e))
+            timings.append(time.perf_counter() - start)
+    return chatbot, timings, errors
+
+
+async def _gather_sessions(chatbots, conversations):
+    return await asyncio.gather(*(arun_session(chatbot, conversations) for chatbot in chatbots))
+
+
+def run_level(sessions, conversations, use_async=False):
+    from webpages.pages_util.agent import AutoMentorChatbot, get_agent_loop
+
+    gc.collect()
+    rss_before = rss_mb()
+    start = time.perf_counter()
+    if use_async:
+        # Created here, building the agents would block the loop the other sessions run on
+        chatbots = [AutoMentorChatbot() for _ in range(sessions)]
+        results = asyncio.run_coroutine_threadsafe(_gather_sessions(chatbots, conversations),
+                                                   get_agent_loop()).result()
+    else:
+        with ThreadPoolExecutor(max_workers=sessions) as executor:
+            results = list(executor.map(lambda _: run_session(conversations), range(sessions)))
+    elapsed = time.perf_counter() - start
+    # The chatbots are still referenced, their memory is measured before they are released
+    rss_after = rss_mb()
+
+    timings = np.concatenate([result[1] for result in results])
+    errors = [error for result in results for error in result[2]]
+    return {"sessions": sessions,
+            "turns": str(len(timings)),
+            "turns/s": len(timings) / elapsed,
+            "p50 (s)": np.percentile(timings, 50),
+            "p95 (s)": np.percentile(timings, 95),
+            "max (s)": timings.max(),
+            "MB/session": max(rss_after - rss_before, 0) / sessions,
+            "errors": str(len(errors))}, errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", nargs="+", type=int, default=[1, 4, 16])
+    parser.add_argument("--latency-ms", type=float, default=300, help="stand-in time to the first token")
+    parser.add_argument("--token-ms", type=float, default=10, help="stand-in time between streamed tokens")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of stand-in requests failing")
+    parser.add_argument("--async", dest="use_async", action="store_true",
+                        help="run the sessions on the agent event loop through agenerate_response")
+    args = parser.parse_args()
+
+    server = start_stub(latency_ms=args.latency_ms, token_ms=args.token_ms, error_rate=args.error_rate)
+    os.environ["OPENAI_API_BASE"] = f"http://127.0.0.1:{server.server_port}/v1"
+    os.environ["OPENAI_API_KEY"] = "sk-stub"
+    os.environ["AUTOMENTOR_RESPONSE_CACHE"] = "0"
+    os.environ["AUTOMENTOR_RETRIEVAL_MODE"] = "lexical"
+    os.environ["AUTOMENTOR_TRACE_PATH"] = ""
+
+    conversations = read_conversations()
+    print(f"{sum(map(len, conversations))} turns per session from {USE_CASES_PATH}, "
+          f"stand-in latency {args.latency_ms:.0f} ms + {args.token_ms:.0f} ms/token, "
+          f"{'async sessions on the agent loop' if args.use_async else 'one thread per session'}\n")
+
+    rows = []
+    all_errors = []
+    # The agent executor is verbose, its chain logs would bury the report
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        # Warm-up session: loads the listings, the indexes and the appraisal models once
+        run_session(conversations)
+
+        for sessions in args.concurrency:
+            row, errors = run_level(sessions, conversations, args.use_async)
+            rows.append(row)
+            all_errors.extend(errors)
+
+    print(pd.DataFrame(rows).set_index("sessions").to_markdown(floatfmt=".2f"))
+    for error in sorted(set(all_errors))[:10]:
+        print(f"- {error}")
+
+    from webpages.pages_util.appraisal_pool import appraisal_pool
+    appraisal_pool.shutdown()
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
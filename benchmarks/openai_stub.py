@@ -0,0 +1,241 @@
+"""
+Local stand-in for the OpenAI API, to run and load-test AutoMentor without paying for or waiting on the real API.
+
+Endpoints:
+- POST /v1/chat/completions: scripted answers, function calls included, streamed as server-sent events when asked
+- POST /v1/embeddings: deterministic bag-of-words vectors
+- GET /v1/models: the models of the scripted answers
+
+The first call of a turn (last message from the user) is answered by the first rule whose regex matches the user's
+message, with either a function call or a text. Later calls (last message from a function) answer with the function
+output, so the listing ids found by the tools reach the chat. Rules are read from a JSON file with --rules, as a list
+of {"match": regex, "function_call": {"name": ..., "arguments": {...}}} or {"match": regex, "content": text}.
+
+Point the app to it with:
+    OPENAI_API_BASE=http://127.0.0.1:8001/v1 OPENAI_API_KEY=sk-stub
+
+Run from the repository root:
+    python -m benchmarks.openai_stub --port 8001 --latency-ms 400 --token-ms 15
+"""
+import argparse
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+EMBEDDING_DIMENSIONS = 1536
+
+# Answers to the use cases of use_cases.md
+DEFAULT_RULES = [
+    {"match": r"citro[eë]n berlingo",
+     "function_call": {"name": "listing_search",
+                       "arguments": {"brand": "Citroën", "model": "Berlingo", "max_price": 15000}}},
+    {"match": r"blue car below",
+     "function_call": {"name": "listing_search", "arguments": {"color": "Blue", "max_price": 50000}}},
+    {"match": r"tell me more about car",
+     "function_call": {"name": "python_repl", "arguments": {"query": "df.iloc[0].to_markdown()"}}},
+    {"match": r"appraise a car",
+     "content": "Yes, I can appraise your car. To do that, I need the following pieces of information from you, "
+                "please inform:\n- Brand\n- Model\n- Year\n- Fuel\n- Displacement (cm3)\n- Power (hp)\n- Gear Type\n"
+                "- Kilometers\n- Condition"},
+    {"match": r"used bmw 520",
+     "function_call": {"name": "price_predictor",
+                       "arguments": {"brand": "BMW", "model": "520", "year": 2019, "displacement_cm3": 2000,
+                                     "power_hp": 190, "gear_type": "Manual", "kilometers": 150000,
+                                     "fuel": "Diesel", "condition": "Used"}}},
+    {"match": r"curiosit|history|founded",
+     "function_call": {"name": "brand_info_search", "arguments": {"query": "BMW history"}}},
+    {"match": r".*",
+     "content": "I'm AutoMentor, I can search car listings for you or appraise your car. How can I help?"},
+]
+
+
+def embed(text):
+    """Unit bag-of-words vector of a text (or list of token ids), the same text always gets the same vector."""
+    vector = np.zeros(EMBEDDING_DIMENSIONS)
+    words = re.findall(r"\w+", text.lower()) if isinstance(text, str) else [str(token) for token in text]
+    for word in words:
+        vector[int(hashlib.md5(word.encode()).hexdigest(), 16) % EMBEDDING_DIMENSIONS] += 1
+    norm = np.linalg.norm(vector)
+    return (vector / norm if norm else vector).tolist()
+
+
+def tokens_of(text):
+    """Split a text in chunks of a few characters, roughly like the API streams them."""
+    return re.findall(r"\s*\S{1,4}", text) or [text]
+
+
+class StubState:
+    def __init__(self, rules, latency_ms, jitter_ms, token_ms, error_rate):
+        self.rules = [(re.compile(rule["match"], re.IGNORECASE), rule) for rule in rules]
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.token_ms = token_ms
+        self.error_rate = error_rate
+        self.requests = 0
+        self.lock = threading.Lock()
+
+    def answer(self, messages, functions):
+        """Return (content, function_call) for a chat completion request."""
+        last = messages[-1]
+        function_names = {function["name"] for function in functions or []}
+        if last["role"] == "user":
+            for pattern, rule in self.rules:
+                if not pattern.search(last.get("content") or ""):
+                    continue
+                call = rule.get("function_call")
+                if call and call["name"] in function_names:
+                    return None, {"name": call["name"], "arguments": json.dumps(call["arguments"])}
+                if rule.get("content"):
+                    return rule["content"], None
+        if last["role"] == "function":
+            return f"Here is what I found:\n{last.get('content', '')}", None
+        return "How can I help you?", None
+
+    def wait(self):
+        delay = max(self.latency_ms + random.uniform(-self.jitter_ms, self.jitter_ms), 0)
+        time.sleep(delay / 1000)
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    state: StubState = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, body):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _read_json(self):
+        length = int(self.headers.get("Content-Length", 0))
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def do_GET(self):
+        if self.path.rstrip("/").endswith("/models"):
+            self._send_json(200, {"object": "list", "data": [
+                {"id": model, "object": "model", "created": 0, "owned_by": "stub"}
+                for model in ["gpt-3.5-turbo", "text-embedding-ada-002"]]})
+        else:
+            self._send_json(404, {"error": {"message": "not found", "type": "invalid_request_error"}})
+
+    def do_POST(self):
+        state = self.state
+        with state.lock:
+            state.requests += 1
+        request = self._read_json()
+
+        if random.random() < state.error_rate:
+            state.wait()
+            self._send_json(500, {"error": {"message": "scripted failure", "type": "server_error"}})
+            return
+
+        if self.path.endswith("/embeddings"):
+            inputs = request.get("input")
+            inputs = [inputs] if isinstance(inputs, str) or (inputs and isinstance(inputs[0], int)) else inputs
+            state.wait()
+            self._send_json(200, {"object": "list", "model": request.get("model"),
+                                  "data": [{"object": "embedding", "index": i, "embedding": embed(text)}
+                                           for i, text in enumerate(inputs)],
+                                  "usage": {"prompt_tokens": 0, "total_tokens": 0}})
+        elif self.path.endswith("/chat/completions"):
+            self._chat_completion(request)
+        else:
+            self._send_json(404, {"error": {"message": "not found", "type": "invalid_request_error"}})
+
+    def _chat_completion(self, request):
+        state = self.state
+        content, function_call = state.answer(request.get("messages", []), request.get("functions"))
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+        finish_reason = "function_call" if function_call else "stop"
+        prompt_tokens = sum(len(str(message.get("content") or "")) for message in request["messages"]) // 4
+        state.wait()
+
+        if not request.get("stream"):
+            message = {"role": "assistant", "content": content}
+            if function_call:
+                message["function_call"] = function_call
+            completion_tokens = len(tokens_of(content or function_call["arguments"]))
+            self._send_json(200, {"id": completion_id, "object": "chat.completion", "created": int(time.time()),
+                                  "model": request.get("model"),
+                                  "choices": [{"index": 0, "message": message, "finish_reason": finish_reason}],
+                                  "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                                            "total_tokens": prompt_tokens + completion_tokens}})
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+
+        def send(delta, finish=None):
+            chunk = {"id": completion_id, "object": "chat.completion.chunk", "created": int(time.time()),
+                     "model": request.get("model"),
+                     "choices": [{"index": 0, "delta": delta, "finish_reason": finish}]}
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+            self.wfile.flush()
+
+        if function_call:
+            send({"role": "assistant", "content": None,
+                  "function_call": {"name": function_call["name"], "arguments": ""}})
+            for token in tokens_of(function_call["arguments"]):
+                time.sleep(state.token_ms / 1000)
+                send({"function_call": {"arguments": token}})
+        else:
+            send({"role": "assistant", "content": ""})
+            for token in tokens_of(content):
+                time.sleep(state.token_ms / 1000)
+                send({"content": token})
+        send({}, finish_reason)
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+        self.close_connection = True
+
+
+def start_stub(host="127.0.0.1", port=0, rules=None, latency_ms=300, jitter_ms=50, token_ms=10, error_rate=0.0):
+    """Start the stand-in in a background thread, return the server (server.server_port is the port)."""
+    handler = type("Handler", (StubHandler,), {"state": StubState(rules or DEFAULT_RULES, latency_ms, jitter_ms,
+                                                                    token_ms, error_rate)})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="openai-stub", daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--rules", help="JSON file of scripted answers, replacing the default ones")
+    parser.add_argument("--latency-ms", type=float, default=300, help="time before the first token")
+    parser.add_argument("--jitter-ms", type=float, default=50)
+    parser.add_argument("--token-ms", type=float, default=10, help="time between streamed tokens")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests answered with a 500")
+    args = parser.parse_args()
+
+    rules = None
+    if args.rules:
+        with open(args.rules, encoding="utf-8") as f:
+            rules = json.load(f)
+    server = start_stub(args.host, args.port, rules, args.latency_ms, args.jitter_ms, args.token_ms, args.error_rate)
+    print(f"OpenAI stand-in listening on http://{args.host}:{server.server_port}/v1")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
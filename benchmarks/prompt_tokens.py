@@ -0,0 +1,117 @@
+"""
+Input tokens and latency of the agent prompt modes ("full" and "compact").
+
+Offline (default): the prompt of the first agent call of each question is built through the chain's own input
+mapping and prompt, and its tokens are counted with tiktoken, messages and function schemas included. Every later
+step of a turn resends the same prompt plus the scratchpad, so the difference between the modes is paid once per step.
+
+--live: the questions are answered by AutoMentorChatbot with the OpenAI API (OPENAI_API_KEY must be set, the
+response cache is disabled), counting the tokens of every model call of the turn and timing the whole turn.
+
+Run from the repository root:
+    python -m benchmarks.prompt_tokens
+    python -m benchmarks.prompt_tokens --live
+"""
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+import pandas as pd
+import tiktoken
+from langchain.callbacks.base import BaseCallbackHandler
+
+QUESTIONS = ["Hello! Can you help me find a citroen berlingo below 15000 euros?",
+             "Can you help me finding a blue car below 50000 euros?",
+             "I want an automatic diesel SUV from 2018 or newer",
+             "Which is the cheapest electric car?",
+             "Can you help me appraise a car?",
+             "What are some curiosities about BMW?"]
+
+encoding = tiktoken.get_encoding("cl100k_base")
+
+
+def count_message_tokens(messages):
+    # Every chat message costs its content plus a few formatting tokens
+    return sum(4 + len(encoding.encode(message.content)) for message in messages) + 3
+
+
+def count_function_tokens(functions):
+    return len(encoding.encode(json.dumps(functions)))
+
+
+class TokenCounter(BaseCallbackHandler):
+    def __init__(self, functions_tokens):
+        self.functions_tokens = functions_tokens
+        self.calls = 0
+        self.tokens = 0
+
+    def on_chat_model_start(self, serialized, messages, **kwargs):
+        self.calls += 1
+        self.tokens += count_message_tokens(messages[0]) + self.functions_tokens
+
+
+def offline(mode):
+    from webpages.pages_util.agent import get_chain
+
+    executor = get_chain(prompt_mode=mode)
+    inputs, prompt, llm_with_tools = executor.agent.runnable.steps[:3]
+    functions_tokens = count_function_tokens(llm_with_tools.kwargs["functions"])
+
+    tokens = []
+    timings = []
+    for question in QUESTIONS:
+        start = time.perf_counter()
+        messages = (inputs | prompt).invoke({"input": question, "agent_memory": [],
+                                             "intermediate_steps": []}).to_messages()
+        timings.append((time.perf_counter() - start) * 1000)
+        tokens.append(count_message_tokens(messages) + functions_tokens)
+
+    return {"mode": mode,
+            "tokens per call": np.mean(tokens),
+            "function schema tokens": functions_tokens,
+            "prompt build p50 (ms)": np.percentile(timings, 50)}
+
+
+def live(mode):
+    from langchain.globals import set_llm_cache
+    from webpages.pages_util.agent import AutoMentorChatbot
+
+    chatbot = AutoMentorChatbot(prompt_mode=mode)
+    set_llm_cache(None)
+    functions_tokens = count_function_tokens(chatbot.agent.agent.runnable.steps[2].kwargs["functions"])
+
+    calls, tokens, timings = [], [], []
+    for question in QUESTIONS:
+        counter = TokenCounter(functions_tokens)
+        chatbot.agent_memory = []
+        start = time.perf_counter()
+        chatbot.agent.invoke({"input": question, "agent_memory": []}, config={"callbacks": [counter]})
+        timings.append(time.perf_counter() - start)
+        calls.append(counter.calls)
+        tokens.append(counter.tokens)
+
+    return {"mode": mode,
+            "model calls per turn": np.mean(calls),
+            "tokens per turn": np.mean(tokens),
+            "turn p50 (s)": np.percentile(timings, 50),
+            "turn p95 (s)": np.percentile(timings, 95)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--modes", nargs="+", default=["full", "compact"], choices=["full", "compact"])
+    parser.add_argument("--live", action="store_true", help="answer the questions with the OpenAI API")
+    args = parser.parse_args()
+
+    if not args.live:
+        # The chain is only built, no request is sent
+        os.environ.setdefault("OPENAI_API_KEY", "sk-offline")
+
+    rows = [live(mode) if args.live else offline(mode) for mode in args.modes]
+    print(pd.DataFrame(rows).set_index("mode").to_markdown(floatfmt=".2f"))
+
+
+if __name__ == "__main__":
+    main()
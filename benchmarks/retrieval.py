@@ -0,0 +1,88 @@
+"""
+Recall@k and latency of the brand_info_search retrieval modes.
+
+Every chunk of the FAISS index is labelled with the brand it talks about (the brand it mentions the most, or the
+brand of the previous chunk when it mentions none), and a set of brand questions is run through each mode. A
+question is recalled at k when one of its k first chunks belongs to the brand it asks about.
+
+The dense and hybrid modes embed the questions with the cached embeddings, so only the first (untimed) run of a
+question calls the API. Skip them with --modes lexical when no API key is available.
+
+Run from the repository root:
+    python -m benchmarks.retrieval
+    python -m benchmarks.retrieval --modes lexical --repeat 200
+"""
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from webpages.pages_util.lexical import RETRIEVAL_MODES, HybridRetriever, faiss_texts, get_lexical_index
+from webpages.pages_util.vectorstore import get_vectorstore
+
+BRANDS = ["Toyota", "Honda", "Ford", "Chevrolet", "BMW", "Mercedes-Benz", "Audi", "Volkswagen", "Nissan", "Tesla"]
+QUESTIONS = ["Tell me about {brand}", "Who founded {brand}?", "What is the history of {brand}?",
+             "Some curiosities about {brand}", "Is {brand} involved in motorsport?",
+             "What does {brand} do for the environment?", "Which safety innovations did {brand} introduce?",
+             "Where does {brand} build its cars?"]
+
+
+def label_chunks(texts):
+    labels = []
+    for text in texts:
+        counts = [text.lower().count(brand.lower()) for brand in BRANDS]
+        labels.append(BRANDS[int(np.argmax(counts))] if max(counts) else (labels[-1] if labels else None))
+    return labels
+
+
+def evaluate(retriever, labels, ks, repeat):
+    """Recall at each k and latencies (ms) of the questions."""
+    position_of = {retriever.vectorstore.index_to_docstore_id[i]: i for i in range(len(labels))}
+    content_position = {retriever.vectorstore.docstore.search(docstore_id).page_content: position
+                        for docstore_id, position in position_of.items()}
+
+    retriever.k = max(ks)
+    recalled = {k: [] for k in ks}
+    timings = []
+    for brand in BRANDS:
+        for question in QUESTIONS:
+            query = question.format(brand=brand)
+            documents = retriever.get_relevant_documents(query)
+            for _ in range(repeat):
+                start = time.perf_counter()
+                retriever.get_relevant_documents(query)
+                timings.append((time.perf_counter() - start) * 1000)
+
+            found = [labels[content_position[document.page_content]] for document in documents]
+            for k in ks:
+                recalled[k].append(brand in found[:k])
+    return {k: np.mean(values) for k, values in recalled.items()}, np.array(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--modes", nargs="+", default=RETRIEVAL_MODES, choices=RETRIEVAL_MODES)
+    parser.add_argument("--ks", nargs="+", type=int, default=[1, 4])
+    parser.add_argument("--repeat", type=int, default=20, help="timed runs of each question")
+    args = parser.parse_args()
+
+    vectorstore = get_vectorstore()
+    labels = label_chunks(faiss_texts(vectorstore))
+    lexical = get_lexical_index(vectorstore)
+
+    rows = []
+    for mode in args.modes:
+        retriever = HybridRetriever(vectorstore=vectorstore, lexical=lexical, mode=mode)
+        recall, timings = evaluate(retriever, labels, args.ks, args.repeat)
+        rows.append({"mode": mode,
+                     **{f"recall@{k}": value for k, value in recall.items()},
+                     "p50 (ms)": np.percentile(timings, 50),
+                     "p95 (ms)": np.percentile(timings, 95)})
+
+    print(f"{len(BRANDS) * len(QUESTIONS)} questions over {len(labels)} chunks\n")
+    print(pd.DataFrame(rows).set_index("mode").to_markdown(floatfmt=".3f"))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+"""
+Latency percentiles of the spans recorded by the chatbot's tracing handler.
+
+Reads the JSONL trace file (AUTOMENTOR_TRACE_PATH, webpages/pages_util/traces.jsonl by default) and reports the
+count, p50/p95 duration, token counts and payload sizes per span type, or per span type and name.
+
+Run from the repository root:
+    python -m benchmarks.trace_report
+    python -m benchmarks.trace_report --by-name --since 3600
+"""
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from webpages.pages_util.util import TRACE_PATH
+
+
+def percentile(q):
+    def aggregate(values):
+        return np.percentile(values, q)
+    aggregate.__name__ = f"p{q}"
+    return aggregate
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--path", default=TRACE_PATH)
+    parser.add_argument("--by-name", action="store_true", help="group the spans by type and name")
+    parser.add_argument("--since", type=float, help="only the spans of the last SINCE seconds")
+    args = parser.parse_args()
+
+    spans = pd.read_json(args.path, lines=True)
+    if args.since:
+        spans = spans[spans["start"] >= time.time() - args.since]
+    if spans.empty:
+        print("No spans recorded.")
+        return
+
+    for column in ["prompt_tokens", "completion_tokens", "error"]:
+        if column not in spans:
+            spans[column] = np.nan
+
+    groups = ["type", "name"] if args.by_name else ["type"]
+    report = spans.groupby(groups).agg(
+        count=("duration_ms", "size"),
+        errors=("error", "count"),
+        p50_ms=("duration_ms", percentile(50)),
+        p95_ms=("duration_ms", percentile(95)),
+        mean_prompt_tokens=("prompt_tokens", "mean"),
+        mean_completion_tokens=("completion_tokens", "mean"),
+        mean_input_chars=("input_chars", "mean"),
+        mean_output_chars=("output_chars", "mean"),
+    )
+    print(f"{len(spans)} spans, {spans['session'].nunique()} sessions\n")
+    print(report.to_markdown(floatfmt=".1f"))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""
+Login, signup and profile edit latency of the SQLite user store against the customer_data.csv code it replaced.
+
+A synthetic customer_data.csv of --users users is migrated into a fresh store, then random users are looked up,
+authenticated and updated and new users are signed up. The CSV baseline runs the former code once per action:
+a login read the whole file and built a dict per user with iterrows, a signup or a profile edit read the whole file
+and wrote it back.
+
+Run from the repository root:
+    python -m benchmarks.user_store
+    python -m benchmarks.user_store --users 100000 --operations 5000 --skip-csv
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from webpages.pages_util.user_store import UserExistsError, UserStore
+
+
+def make_users(n, seed=0):
+    rng = np.random.default_rng(seed)
+    ids = np.arange(n).astype(str)
+    usernames = np.char.add("user", ids)
+    return pd.DataFrame({"Email": np.char.add(usernames, "@example.com"),
+                         "Full Name": np.char.add("User ", ids),
+                         "Username": usernames,
+                         "Password": np.char.add("pw", rng.integers(0, 10 ** 6, n).astype(str)),
+                         "Age": rng.integers(18, 90, n),
+                         "Location": rng.choice(["Lisboa", "Porto", "Faro", "Braga"], n),
+                         "Bot Preferences": "Talk like a butler"})
+
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, (time.perf_counter() - start) * 1000
+
+
+def percentiles(name, timings):
+    return {"operation": name, "count": str(len(timings)), "p50 (ms)": np.percentile(timings, 50),
+            "p95 (ms)": np.percentile(timings, 95)}
+
+
+def csv_login(path):
+    credentials, user_data = {}, {}
+    for _, row in pd.read_csv(path).iterrows():
+        credentials[row['Username']] = row['Password']
+        user_data[row['Username']] = {'Email': row['Email'], 'Username': row['Username']}
+    return credentials
+
+
+def csv_signup(path, user):
+    customer_data = pd.read_csv(path)
+    if user["Username"] in customer_data['Username'].values or user["Email"] in customer_data['Email'].values:
+        return
+    pd.concat([customer_data, pd.DataFrame([user])], ignore_index=True).to_csv(path, index=False)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=1_000_000)
+    parser.add_argument("--operations", type=int, default=2000, help="store operations timed per kind")
+    parser.add_argument("--skip-csv", action="store_true", help="don't time the CSV baseline")
+    args = parser.parse_args()
+
+    users = make_users(args.users)
+    rng = np.random.default_rng(1)
+    sample = users.iloc[rng.integers(0, args.users, args.operations)]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        csv_path = os.path.join(tmp, "customer_data.csv")
+        users.to_csv(csv_path, index=False)
+
+        store, migration_ms = timed(UserStore, os.path.join(tmp, "users.sqlite"), csv_path)
+        db_mb = sum(os.path.getsize(os.path.join(tmp, name)) for name in os.listdir(tmp)
+                    if name.startswith("users.sqlite")) / 1024 ** 2
+        print(f"{len(store)} users migrated in {migration_ms / 1000:.1f} s, database {db_mb:.0f} MB\n")
+
+        rows = [
+            percentiles("get by username", [timed(store.get, user)[1] for user in sample["Username"]]),
+            percentiles("get by email", [timed(store.get_by_email, email)[1] for email in sample["Email"]]),
+            percentiles("login (authenticate)", [timed(store.authenticate, user, password)[1]
+                                                 for user, password in zip(sample["Username"], sample["Password"])]),
+            percentiles("profile edit (update)", [timed(store.update, user, {"Location": "Coimbra"})[1]
+                                                  for user in sample["Username"]]),
+        ]
+
+        signups, duplicates = [], 0
+        for i in range(args.operations):
+            user = {"Email": f"new{i}@example.com", "Full Name": f"New {i}", "Username": f"new{i}",
+                    "Password": "secret", "Age": 30, "Location": "Lisboa", "Bot Preferences": "None"}
+            signups.append(timed(store.create, user)[1])
+            try:
+                store.create(dict(user, Username=f"other{i}"))
+            except UserExistsError:
+                duplicates += 1
+        rows.append(percentiles("signup (create)", signups))
+        print(f"{duplicates}/{args.operations} signups reusing an email rejected\n")
+        store.close()
+
+        if not args.skip_csv:
+            rows.append({"operation": "CSV login", "count": "1", "p50 (ms)": timed(csv_login, csv_path)[1]})
+            new_user = {"Email": "csv@example.com", "Full Name": "Csv", "Username": "csv", "Password": "secret",
+                        "Age": 30, "Location": "Lisboa", "Bot Preferences": "None"}
+            rows.append({"operation": "CSV signup or profile edit", "count": "1",
+                         "p50 (ms)": timed(csv_signup, csv_path, new_user)[1]})
+
+    print(pd.DataFrame(rows).set_index("operation").to_markdown(floatfmt=".3f"))
+
+
+if __name__ == "__main__":
+    main()
@@ -3,8 +3,12 @@ from PyPDF2 import PdfReader
 from langchain_openai import OpenAIEmbeddings
 from langchain.text_splitter import CharacterTextSplitter
 import os
+import sys
 from dotenv import load_dotenv, find_dotenv
 
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
+from webpages.pages_util.lexical import BM25Index, LEXICAL_INDEX_FILE
+
 load_dotenv(find_dotenv())
 
 parent_directory = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
@@ -30,3 +34,6 @@ final_data = text_splitter.split_text(pdf_text)
 embeddings = OpenAIEmbeddings()
 db = FAISS.from_texts(final_data, embeddings)
 db.save_local('FAISS_car_brands_curiosities')
+
+# Local BM25 index over the same chunks, used by the hybrid retriever and when embeddings are unavailable
+BM25Index(final_data).save(os.path.join('FAISS_car_brands_curiosities', LEXICAL_INDEX_FILE))
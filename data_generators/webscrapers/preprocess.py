@@ -1,4 +1,7 @@
+import json
 import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
 from util import get_completion
 import re
 from unidecode import unidecode
@@ -54,3 +57,26 @@ data = data.replace(replace_dict)
 data.columns = eval(response1)
 
 data.to_csv('car_dataset.csv')
+
+# Export a columnar copy of the dataset with a declared schema, the app loads it (memory-mapped) instead of the CSV
+# Low-cardinality strings become categoricals and the integer columns nullable small integers
+schema = {'Advertiser': 'category', 'Brand': 'category', 'Model': 'category', 'Fuel': 'category',
+          'Segment': 'category', 'Color': 'category', 'Gear_Type': 'category', 'Condition': 'category',
+          'Compared_Price': 'category', 'Year': 'Int16', 'Kilometers': 'Int32', 'Displacement_cm3': 'Int16',
+          'Power_hp': 'Int16', 'Price_EUR': 'Int32'}
+typed_data = data.astype({col: dtype for col, dtype in schema.items() if col in data.columns})
+
+# Uncompressed so the file can be memory-mapped, the index (listing ids) is kept in the pandas metadata
+feather.write_feather(pa.Table.from_pandas(typed_data, preserve_index=True), 'car_dataset.feather',
+                      compression='uncompressed')
+
+# Catalogue of the columns and the unique values of each categorical column, used to build the agent prompt and
+# to validate search filters without scanning the dataset
+catalogue_cols = ['Advertiser', 'Brand', 'Model', 'Fuel', 'Segment', 'Color', 'Gear_Type', 'Condition',
+                  'Compared_Price']
+catalogue = {'columns': list(typed_data.columns),
+             'dtypes': {col: str(dtype) for col, dtype in typed_data.dtypes.items()},
+             'categories': {col: typed_data[col].dropna().unique().tolist() for col in catalogue_cols
+                            if col in typed_data.columns}}
+with open('car_dataset_catalogue.json', 'w', encoding='utf-8') as f:
+    json.dump(catalogue, f, ensure_ascii=False, indent=1)
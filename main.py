@@ -1,10 +1,33 @@
+import importlib
 import streamlit as st
 from streamlit_option_menu import option_menu  # pip install streamlit-option-menu
-from webpages import home, account, chatbot, blog, policies, contacts
+from webpages.pages_util.warmup import WARMUP_ENABLED, get_warmup
 
 
 st.set_page_config(page_title='AutoMentor', page_icon='🏁', layout='wide')
 
+# Starts once per server process, the following runs of the script only get the running warm-up
+if WARMUP_ENABLED:
+    get_warmup()
+
+
+# Page title: (module, menu icon). A page module is only imported the first time its page is selected, so the
+# chatbot's dependencies (langchain, FAISS, sklearn, umap) are not loaded before the Home page renders.
+PAGES = {
+    'Home': ('webpages.home', 'house'),
+    'Account': ('webpages.account', 'person'),
+    'Chatbot': ('webpages.chatbot', 'robot'),
+    'Blog': ('webpages.blog', 'pencil'),
+    'Policies': ('webpages.policies', 'receipt'),
+    'Contacts': ('webpages.contacts', 'telephone'),
+}
+
+
+def load_page(title):
+    # Imported modules stay in sys.modules, later reruns get the page without importing it again
+    module_name, _ = PAGES[title]
+    return importlib.import_module(module_name)
+
 
 class MultiApp:
 
@@ -33,8 +56,8 @@ class MultiApp:
 
             app = option_menu(
                 menu_title='🚘 AutoMentor 🚘',
-                options=['Home', 'Account', 'Chatbot', 'Blog', 'Policies', 'Contacts'],
-                icons=['house', 'person', 'robot', 'pencil', 'receipt', 'telephone'],
+                options=list(PAGES),
+                icons=[icon for _, icon in PAGES.values()],
                 menu_icon=' ',
                 default_index=0
             )
@@ -42,17 +65,6 @@ class MultiApp:
             st.image(r"https://sp-ao.shortpixel.ai/client/to_webp,q_glossy,ret_img,w_1150/https://www.st-agnes.manchester.sch.uk/wp-content/uploads/2018/11/car-gif-png-1.gif", width=250)
 
 
-        if app == 'Home':
-            home.app()
-        if app == 'Account':
-            account.app()
-        if app == 'Chatbot':
-            chatbot.app()
-        if app == 'Blog':
-            blog.app()
-        if app == 'Policies':
-            policies.app()
-        if app == 'Contacts':
-            contacts.app()
+        load_page(app).app()
 
     run()
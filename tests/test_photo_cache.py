@@ -0,0 +1,122 @@
+import io
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from PIL import Image
+
+from webpages.pages_util.photo_cache import PhotoCache, THUMBNAIL_SIZE
+
+
+def make_photo(size=(1200, 900), color="red"):
+    output = io.BytesIO()
+    Image.new("RGB", size, color).save(output, format="PNG")
+    return output.getvalue()
+
+
+class PhotoServer(ThreadingHTTPServer):
+    """Local stand-in for the listing photo host: /photo/<name> serves a photo, anything else is a 404."""
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), PhotoHandler)
+        self.photos = {}
+        self.requests = []
+
+    def url(self, path):
+        return f"http://127.0.0.1:{self.server_address[1]}{path}"
+
+
+class PhotoHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        self.server.requests.append(self.path)
+        content = self.server.photos.get(self.path)
+        if content is None:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "image/png")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    server = PhotoServer()
+    server.photos = {f"/photo/{i}": make_photo() for i in range(1, 4)}
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return PhotoCache(directory=str(tmp_path), workers=2)
+
+
+def test_photo_is_downloaded_once_as_a_thumbnail(server, cache):
+    thumbnail = cache.fetch(1, server.url("/photo/1"))
+
+    image = Image.open(io.BytesIO(thumbnail))
+    assert image.format == "JPEG"
+    assert image.width <= THUMBNAIL_SIZE[0] and image.height <= THUMBNAIL_SIZE[1]
+    assert cache.get(1, server.url("/photo/1")) == thumbnail
+    assert server.requests == ["/photo/1"]
+
+
+def test_get_does_not_wait_for_the_download(server, cache):
+    assert cache.get(2, server.url("/photo/2")) is None
+
+    # The download started in the background, waiting for it doesn't fetch the photo again
+    assert cache.fetch(2, server.url("/photo/2")) is not None
+    assert cache.get(2, server.url("/photo/2")) is not None
+    assert server.requests == ["/photo/2"]
+
+
+def test_thumbnails_survive_a_restart(server, cache, tmp_path):
+    thumbnail = cache.fetch(1, server.url("/photo/1"))
+
+    assert PhotoCache(directory=str(tmp_path)).get(1, server.url("/photo/1")) == thumbnail
+    assert server.requests == ["/photo/1"]
+
+
+def test_failed_download_is_not_retried_before_the_ttl(server, tmp_path):
+    cache = PhotoCache(directory=str(tmp_path), failure_ttl=600)
+
+    assert cache.fetch(9, server.url("/missing")) is None
+    assert cache.get(9, server.url("/missing")) is None
+    assert cache.fetch(9, server.url("/missing")) is None
+    assert server.requests == ["/missing"]
+
+
+def test_failed_download_is_retried_after_the_ttl(server, tmp_path):
+    cache = PhotoCache(directory=str(tmp_path), failure_ttl=0)
+
+    assert cache.fetch(9, server.url("/photo/9")) is None
+    server.photos["/photo/9"] = make_photo()
+    assert cache.fetch(9, server.url("/photo/9")) is not None
+    assert server.requests == ["/photo/9", "/photo/9"]
+
+
+def test_least_recently_used_thumbnails_are_evicted(server, tmp_path):
+    size = len(PhotoCache(directory=str(tmp_path / "probe")).fetch(1, server.url("/photo/1")))
+    cache = PhotoCache(directory=str(tmp_path / "cache"), max_bytes=2 * size)
+
+    cache.fetch(1, server.url("/photo/1"))
+    cache.fetch(2, server.url("/photo/2"))
+    cache.get(1, server.url("/photo/1"))
+    cache.fetch(3, server.url("/photo/3"))
+
+    assert sorted(cache._entries) == [1, 3]
+    assert sorted(path.name for path in (tmp_path / "cache").iterdir()) == ["1.jpg", "3.jpg"]
+
+
+def test_missing_photos_are_not_fetched(server, cache):
+    assert cache.get(1, "Não disponível") is None
+    assert cache.fetch(1, None) is None
+    assert server.requests == []
@@ -0,0 +1,58 @@
+import pandas as pd
+import pytest
+
+from webpages.pages_util import router
+from webpages.pages_util.listing_store import ListingStore
+
+LISTINGS = pd.DataFrame({"Brand": ["BMW", "Audi", "Peugeot"], "Model": ["320", "A4", "208"],
+                         "Link": ["https://example.com/8342", "https://example.com/2019", None]},
+                        index=[8342, 2019, 57])
+
+
+@pytest.fixture(autouse=True)
+def listing_store(monkeypatch):
+    monkeypatch.setattr(router, "get_listing_store", lambda: ListingStore(LISTINGS.copy(), "test"))
+
+
+@pytest.mark.parametrize("message, route", [
+    ("Please tell me more about car 8342.", ("listing_details", 8342)),
+    ("Can you tell me more about car 57?", ("listing_details", 57)),
+    ("details of listing #8342", ("listing_details", 8342)),
+    ("more info on car nº 57", ("listing_details", 57)),
+    ("link to listing 8342", ("listing_link", 8342)),
+    ("show me the link of car #57 please", ("listing_link", 57)),
+    # Year-like numbers are only ids when marked as such
+    ("details of the car #2019", ("listing_details", 2019)),
+    ("tell me more about car number 2019", ("listing_details", 2019)),
+    ("show me the link of car id 2019", ("listing_link", 2019)),
+])
+def test_listing_lookups_are_routed(message, route):
+    assert router.route_message(message) == route
+
+
+@pytest.mark.parametrize("message", [
+    # Year-like numbers after car/listing
+    "details of the car 2019",
+    "tell me more about a car 2015",
+    "show me a listing 2020 with low kilometers",
+    # Unmarked numbers in a longer question are counts, years or prices
+    "show me a car 5 seats",
+    "a car 2015",
+    "show me a car 5000 km or less",
+    "tell me more about car 8342 and its price history",
+    # Numbers without a car/listing token
+    "tell me more about #8342",
+    "tell me more about 8342",
+    # Ids missing from the store go to the agent
+    "tell me more about car 9999",
+    # Several ids or a question for the agent
+    "tell me more about car 8342 and car 57",
+    "is car 8342 cheaper than car 57?",
+    "what is car 8342 worth",
+])
+def test_other_messages_go_to_the_agent(message):
+    assert router.route_message(message) is None
+
+
+def test_year_like_id_falls_through_to_the_agent():
+    assert router.answer_simple_intent("details of the car 2019") is None
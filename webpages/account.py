@@ -1,7 +1,6 @@
 import streamlit as st
 from webpages.pages_util.login import login_signup
-import pandas as pd
-from webpages.pages_util.util import CUSTOMER_DATA_PATH
+from webpages.pages_util.user_store import UserExistsError, get_user_store
 
 
 def app():
@@ -31,13 +30,14 @@ def app():
 
         # Save the edited data
         if st.button("Save Changes"):
-            if isinstance(new_password, str):
-                save_data(edited_data, new_password)
+            try:
+                save_data(edited_data, new_password if isinstance(new_password, str) else None)
+            except UserExistsError as e:
+                st.error(f"{e.field} is already taken. Please choose a different one.")
             else:
-                save_data(edited_data, None)
-            st.session_state["user_data"] = edited_data
-            st.session_state["editing_info"] = False
-            st.rerun()
+                st.session_state["user_data"] = edited_data
+                st.session_state["editing_info"] = False
+                st.rerun()
 
     # Edit Info button
     if st.button("Edit Info"):
@@ -49,27 +49,8 @@ def app():
 
 
 def save_data(user_data, new_password):
-    """Save the user data to the CSV file."""
+    """Save the user data to the user store, and the new password if one was entered."""
     user_data['Age'] = int(user_data['Age'])
 
-    customer_data = pd.read_csv(CUSTOMER_DATA_PATH)
-
-    index_to_update = customer_data.index[customer_data['Username'] == st.session_state['user_data']['Username']][0]
-
-    old_record = customer_data.loc[index_to_update].copy()
-
-    if new_password:
-        user_data['Password'] = new_password
-    else:
-        user_data['Password'] = old_record['Password']
-
-    # Change all values in the row to the new values except for the 'Password' column
-    for key, value in user_data.items():
-        old_record.loc[key] = value
-
-    # Update the original DataFrame with the modified row
-    customer_data.loc[index_to_update] = old_record
-
-    # Save the updated DataFrame to a new CSV file
-    customer_data.to_csv(CUSTOMER_DATA_PATH, index=False)
-    del user_data['Password']
\ No newline at end of file
+    # Only the user's row is written, the username and email stay unique
+    get_user_store().update(st.session_state['user_data']['Username'], user_data, new_password or None)
@@ -2,9 +2,14 @@ import time
 import streamlit as st
 from langchain_core.messages import AIMessage
 
-from webpages.pages_util.agent import AutoMentorChatbot
+from webpages.pages_util.appraisal_pool import appraisal_pool
 from webpages.pages_util.login import login_signup
+from webpages.pages_util.listing_store import get_listing_store, get_listings
+from webpages.pages_util.photo_cache import get_photo_cache, NO_PHOTO
+from webpages.pages_util.repl_pool import repl_pool
+from webpages.pages_util.response_cache import RESPONSE_CACHE_ENABLED, get_response_cache
 from webpages.pages_util.util import extract_listing_ids, generate_markdown_table
+from webpages.pages_util.warmup import WARMUP_ENABLED, get_warmup
 
 
 def initialize() -> None:
@@ -29,45 +34,98 @@ def initialize() -> None:
     st.title("AutoMentor")
 
     if "chatbot" not in st.session_state:
+        # The agent pulls in langchain and the appraisal models, it is only imported once the user is logged in
+        from webpages.pages_util.agent import AutoMentorChatbot
+
         st.session_state.chatbot = AutoMentorChatbot(conversation_preferences=st.session_state['user_data'][
-                                                         'Bot Preferences'])
+                                                         'Bot Preferences'],
+                                                     api_key=st.session_state.get('api_key'))
 
     with st.sidebar:
         st.markdown(
             f"ChatBot in use: <font color='cyan'>{st.session_state.chatbot.__str__()}</font>", unsafe_allow_html=True
         )
+        st.caption(f"Shared listing store: {get_listing_store()}")
+        st.caption(f"Photo cache: {get_photo_cache()}")
+        st.caption(f"Python sandbox: {repl_pool}")
+        st.caption(f"Appraisal workers: {appraisal_pool}")
+        if RESPONSE_CACHE_ENABLED:
+            st.caption(f"Response cache: {get_response_cache()}")
+        if WARMUP_ENABLED:
+            st.caption(f"Server warm-up: {get_warmup()}")
 
     st.success(f"👋 Welcome back, {st.session_state['user_data']['Full Name']}!")
 
 
+MORE_INFO = "If you would like more information about a particular car, please specify the corresponding car number 😊."
+TRACE_COLUMNS = ["type", "name", "duration_ms", "first_token_ms", "prompt_tokens", "completion_tokens",
+                 "input_chars", "output_chars", "error"]
+# Number of history messages rendered on a rerun, older ones are shown a page at a time on request
+HISTORY_PAGE_SIZE = 20
+
+
+def make_assistant_record(message: str):
+    """
+    Parse an assistant message once, with the listings table and photos it refers to, to be rendered on every rerun
+    """
+    listing_ids, clean_message = extract_listing_ids(message)
+    record = {"role": "assistant", "content": message, "text": clean_message, "listing_ids": listing_ids,
+              "table": None, "photos": []}
+    if listing_ids:
+        table, photo_df = generate_markdown_table(get_listings(), listing_ids)
+        record["table"] = table
+        record["photos"] = list(zip(listing_ids, photo_df['Photo'], photo_df['Car']))
+        # Usually already downloaded by the search tool, otherwise the photos are fetched in parallel
+        get_photo_cache().prefetch(listing_ids)
+        record["content"] = message + MORE_INFO
+    return record
+
+
+def display_listings(record: dict, **image_kwargs):
+    """
+    Display the listings table and photos of an assistant record
+    """
+    if not record["table"]:
+        return
+
+    st.markdown(f"\n\n{record['table']}")
+    st.markdown("")
+    st.markdown("\n\nHere are the corresponding photos:\n\n")
+    columns = st.columns(5)
+    photo_cache = get_photo_cache()
+    for column, (listing_id, photo, car) in zip(columns, record["photos"]):
+        with column:
+            if photo == NO_PHOTO:
+                st.markdown(f"\n\n🚫 Photo not available\n\n\n{car}")
+                continue
+            # Local thumbnail, the remote photo is shown while it downloads or if it couldn't be downloaded
+            st.image(photo_cache.get(listing_id, photo) or photo, caption=car, **image_kwargs)
+
+    st.markdown("")
+    st.markdown(MORE_INFO)
+
+
+def show_earlier_messages():
+    st.session_state.history_shown += HISTORY_PAGE_SIZE
+
+
 def display_history_messages():
     # Display chat messages from history on app rerun
     avatar_dict = {'assistant': '🤖', 'user': '😎'}
-    for message in st.session_state.chatbot.chat_history:
-        if message['role'] == 'assistant':
-            listing_ids, clean_message = extract_listing_ids(message['content'])
-            with st.chat_message(message['role'], avatar=avatar_dict[message['role']]):
-                st.markdown(clean_message)
-                if listing_ids:
-                    table, photo_df = generate_markdown_table(st.session_state.chatbot.agent.tools[0].locals['df'],
-                                                              listing_ids)
-                    st.markdown(f"\n\n{table}")
-                    st.markdown("")
-                    st.markdown("\n\nHere are the corresponding photos:\n\n")
-                    num_images = len(photo_df)
-                    columns = st.columns(5)
-                    for i in range(num_images):
-                        with columns[i]:
-                            if photo_df['Photo'][i] == 'Não disponível':
-                                st.markdown(f"\n\n🚫 Photo not available\n\n\n{photo_df['Car'][i]}")
-                                continue
-                            st.image(photo_df['Photo'][i], caption=photo_df['Car'][i], width=200)
-
-                    st.markdown("")
-                    st.markdown(
-                        "If you would like more information about a particular car, please specify the corresponding car number 😊.")
-        else:
-            with st.chat_message(message['role'], avatar=avatar_dict[message['role']]):
+    chat_history = st.session_state.chatbot.chat_history
+
+    # Only the latest messages are rendered, a long conversation doesn't slow down every rerun
+    shown = st.session_state.setdefault("history_shown", HISTORY_PAGE_SIZE)
+    hidden = max(len(chat_history) - shown, 0)
+    if hidden:
+        st.button(f"⬆️ Show earlier messages ({hidden} hidden)", on_click=show_earlier_messages)
+
+    for message in chat_history[hidden:]:
+        with st.chat_message(message['role'], avatar=avatar_dict[message['role']]):
+            if message['role'] == 'assistant':
+                st.markdown(message['text'])
+                display_listings(message, width=200)
+            else:
                 st.markdown(message['content'])
 
 
@@ -85,53 +143,48 @@ def display_user_msg(message: str):
 
 
 # [i]                                                                                            #
-# [i] Display User Message                                                                       #
+# [i] Display Assistant Message                                                                  #
 # [i]                                                                                            #
 
-def simulate_typing(message: str):
-    """
-    Simulate typing
-    """
-    message_placeholder = st.empty()
-
-    # Simulate stream of response with milliseconds delay
-    for i in range(len(message)):
-        time.sleep(0.02)
-        # Add a blinking cursor to simulate typing
-        message_placeholder.markdown(message[:i] + "▌")
+# Minimum time between two renders of a streamed message, re-rendering on every token is quadratic
+STREAM_REFRESH_SECONDS = 0.05
 
-    message_placeholder.markdown(message)
 
-
-def display_assistant_msg(message: str):
+def stream_markdown(stream, message_placeholder):
     """
-    Display assistant message
+    Render a stream of tokens in a placeholder, in batches, and return the whole message
+    """
+    text = ""
+    last_render = 0
+    try:
+        while True:
+            text += next(stream)
+            if time.monotonic() - last_render >= STREAM_REFRESH_SECONDS:
+                # Add a blinking cursor while the answer is being generated
+                message_placeholder.markdown(text + "▌")
+                last_render = time.monotonic()
+    except StopIteration as stop:
+        # The stream returns the final answer, which can differ from the streamed text (e.g. tool output)
+        return stop.value if stop.value is not None else text
+    finally:
+        # Stops the agent if the script is interrupted (rerun, page left) before the end of the answer
+        stream.close()
+
+
+def display_assistant_msg(message: str = None, stream=None):
+    """
+    Display assistant message, either a whole message or a stream of tokens
     """
-    listing_ids, clean_message = extract_listing_ids(message)
-
     with st.chat_message("assistant", avatar="🤖"):
-        simulate_typing(clean_message)
-
-        if listing_ids:
-            table, photo_df = generate_markdown_table(st.session_state.chatbot.agent.tools[0].locals['df'], listing_ids)
-            st.markdown(f"\n\n{table}")
-            st.markdown("")
-            st.markdown("\n\nHere are the corresponding photos:\n\n")
-            num_images = len(photo_df)
-            columns = st.columns(5)
-            for i in range(num_images):
-                with columns[i]:
-                    if photo_df['Photo'][i] == 'Não disponível':
-                        st.markdown(f"\n\n🚫 Photo not available\n\n\n{photo_df['Car'][i]}")
-                        continue
-                    st.image(photo_df['Photo'][i], caption=photo_df['Car'][i], use_column_width="auto")
-
-            st.markdown("")
-            more_info = "If you would like more information about a particular car, please specify the corresponding car number 😊."
-            simulate_typing(more_info)
-            message += more_info
-
-    st.session_state.chatbot.chat_history.append({"role": "assistant", "content": message})
+        message_placeholder = st.empty()
+        if stream is not None:
+            message = stream_markdown(stream, message_placeholder)
+
+        record = make_assistant_record(message)
+        message_placeholder.markdown(record["text"])
+        display_listings(record, use_column_width="auto")
+
+    st.session_state.chatbot.chat_history.append(record)
 
 
 def greeting():
@@ -172,15 +225,16 @@ def app():
     if prompt := st.chat_input("Type your request..."):
         # [*] Request & Response #
         display_user_msg(message=prompt)
-        assistant_response = st.session_state.chatbot.generate_response(
-            message=prompt
-        )
-
-        display_assistant_msg(message=assistant_response)
+        display_assistant_msg(stream=st.session_state.chatbot.stream_response(message=prompt))
 
     # [i] Sidebar #
     with st.sidebar:
         with st.expander("💬 CHAT HISTORY"):
-            st.write(st.session_state.chatbot.chat_history)
+            st.write([{key: message[key] for key in ("role", "content")}
+                      for message in st.session_state.chatbot.chat_history])
         with st.expander("💬 AGENT MEMORY"):
             st.write(st.session_state.chatbot.agent_memory)
+        with st.expander("⏱️ AGENT TRACE"):
+            # Model, tool and retriever calls of the latest turn
+            st.dataframe([{key: span.get(key) for key in TRACE_COLUMNS}
+                          for span in st.session_state.chatbot.tracer.last_turn()], hide_index=True)
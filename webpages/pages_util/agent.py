@@ -1,74 +1,128 @@
-import pandas as pd
-from pydantic import BaseModel, Field
+import asyncio
+import os
+import queue
+import threading
 from langchain.agents import AgentExecutor
+from langchain.callbacks.base import BaseCallbackHandler
+from langchain.globals import set_llm_cache
 from langchain.agents.agent_toolkits.conversational_retrieval.tool import create_retriever_tool
 from langchain.chat_models import ChatOpenAI
-from langchain_openai import OpenAIEmbeddings
 from langchain.prompts import ChatPromptTemplate, MessagesPlaceholder
-from langchain_experimental.tools import PythonAstREPLTool
-from langchain.vectorstores import FAISS
-from langchain_core.messages import AIMessage, HumanMessage
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
 from langchain.tools.convert_to_openai import format_tool_to_openai_function
 from langchain.agents.format_scratchpad import format_to_openai_function_messages
 from langchain.agents.output_parsers import OpenAIFunctionsAgentOutputParser
 
-from webpages.pages_util.template import TEMPLATE
-from webpages.pages_util.price_advisor import CustomPredictorTool
-from webpages.pages_util.util import DATASET_PATH
-
-
-class PythonInputs(BaseModel):
-    query: str = Field(description="code snippet to run")
-
-
-def get_chain(conversation_preferences='None'):
-    pd.set_option("display.max_rows", 20)
-    pd.set_option("display.max_columns", 21)
-
-    embedding_model = OpenAIEmbeddings()
-    vectorstore = FAISS.load_local("./webpages/pages_util/FAISS_car_brands_curiosities", embedding_model)
-    retriever_tool = create_retriever_tool(vectorstore.as_retriever(), "brand_info_search", "Search for information about a car brand")
-
-    df = pd.read_csv(DATASET_PATH, index_col=0)
-    template = TEMPLATE.format(conversation_preferences=conversation_preferences,
-                               dcolumns=str(list(df.columns)),
-                               dfadvertiser=str(list(df.Advertiser.unique())),
-                               dfbrand=str(list(df.Brand.unique())),
-                               dffuel=str(list(df.Fuel.unique())),
-                               dfsegment=str(list(df.Segment.unique())),
-                               dfcolor=str(list(df.Color.unique())),
-                               dfgeartype=str(list(df.Gear_Type.unique())),
-                               dfcondition=str(list(df.Condition.unique())),
-                               dfcomparedprice=str(list(df.Compared_Price.unique())))
-
-    prompt = ChatPromptTemplate.from_messages(
-        [
-            ("system", template),
-            MessagesPlaceholder(variable_name="agent_memory"),
-            ("user", "{input}"),
-            MessagesPlaceholder(variable_name="agent_scratchpad"),
-        ]
-    )
+from webpages.pages_util.template import COMPACT_TEMPLATE, TEMPLATE
+from webpages.pages_util.price_advisor import CustomPredictorTool, CustomBatchPredictorTool
+from webpages.pages_util.catalogue import get_catalogue
+from webpages.pages_util.listing_search import ListingSearchTool, ListValuesTool
+from webpages.pages_util.repl_pool import SandboxedPythonTool
+from webpages.pages_util.router import aanswer_simple_intent, answer_simple_intent
+from webpages.pages_util.vectorstore import get_embeddings, get_vectorstore
+from webpages.pages_util.lexical import RETRIEVAL_MODE, HybridRetriever, get_lexical_index
+from webpages.pages_util.tracing import TracingHandler
+from webpages.pages_util.response_cache import RESPONSE_CACHE_ENABLED, SEMANTIC_CACHE_ENABLED, get_response_cache
 
-    repl = PythonAstREPLTool(
-        locals={"df": df},
-        name="python_repl",
-        description="Runs code and returns the output of the final line",
-        args_schema=PythonInputs,
-    )
 
-    tools = [repl, CustomPredictorTool(), retriever_tool]
+# "full" lists the allowed categorical values in the system prompt, "compact" only gives the ones the query
+# mentions and lets the agent look up the others with the 'list_values' tool
+PROMPT_MODES = {"full": TEMPLATE, "compact": COMPACT_TEMPLATE}
+PROMPT_MODE = os.environ.get("AUTOMENTOR_PROMPT_MODE", "full")
+# Longest an agent turn may run before it is cancelled
+AGENT_TIMEOUT = float(os.environ.get("AUTOMENTOR_AGENT_TIMEOUT", 120))
+AGENT_TIMEOUT_MESSAGE = "Sorry, this is taking longer than expected. Please try again in a moment."
+
+# Identical questions in the same context (or similar ones, with the semantic tier) skip the model call. The cache is
+# global to the process, it is set once when the agent is first imported rather than by every session.
+if RESPONSE_CACHE_ENABLED:
+    set_llm_cache(get_response_cache(get_embeddings() if SEMANTIC_CACHE_ENABLED else None))
+
+_prompts = {}
+
+
+def _escape(value):
+    # Braces in the dataset values must not be parsed as prompt variables
+    return str(value).replace("{", "{{").replace("}", "}}")
+
+
+def value_hints(message: str):
+    """The categorical values mentioned in a message, given to the agent in the compact prompt mode."""
+    matches = get_catalogue().match_values(message)
+    if not matches:
+        return "None"
+    return ", ".join(f"{column}: {values}" for column, values in matches.items())
+
+
+def get_prompt(mode=PROMPT_MODE):
+    """Agent prompt filled with the dataset catalogue, built once per dataset version and prompt mode."""
+    catalogue = get_catalogue()
+    key = (catalogue.version, mode)
+    if key not in _prompts:
+        categories = {column: _escape(values) for column, values in catalogue.categories.items()}
+        template = PROMPT_MODES[mode].format(conversation_preferences="{conversation_preferences}",
+                                             value_hints="{value_hints}",
+                                             dcolumns=_escape(catalogue.columns),
+                                             dfadvertiser=categories['Advertiser'],
+                                             dfbrand=categories['Brand'],
+                                             dffuel=categories['Fuel'],
+                                             dfsegment=categories['Segment'],
+                                             dfcolor=categories['Color'],
+                                             dfgeartype=categories['Gear_Type'],
+                                             dfcondition=categories['Condition'],
+                                             dfcomparedprice=categories['Compared_Price'])
+
+        prompt = ChatPromptTemplate.from_messages(
+            [
+                ("system", template),
+                MessagesPlaceholder(variable_name="agent_memory"),
+                ("user", "{input}"),
+                MessagesPlaceholder(variable_name="agent_scratchpad"),
+            ]
+        )
+        for stale_key in [stale_key for stale_key in _prompts if stale_key[0] != catalogue.version]:
+            del _prompts[stale_key]
+        _prompts[key] = prompt
+    return _prompts[key]
+
+
+def get_chain(conversation_preferences='None', prompt_mode=PROMPT_MODE, tracer=None, api_key=None):
+    # Shared by all the sessions, repeated brand questions are embedded once, new ones with the session's API key
+    vectorstore = get_vectorstore()
+    retriever = HybridRetriever(vectorstore=vectorstore, lexical=get_lexical_index(vectorstore), mode=RETRIEVAL_MODE,
+                                embeddings=get_embeddings(api_key))
+    retriever_tool = create_retriever_tool(retriever, "brand_info_search", "Search for information about a car brand")
+
+    # Only the conversation preferences change between sessions, the rest of the prompt is shared
+    prompt = get_prompt(prompt_mode).partial(conversation_preferences=conversation_preferences)
+
+    # The agent's pandas code runs in sandboxed worker processes holding their own copy of the listings
+    repl = SandboxedPythonTool()
 
-    llm = ChatOpenAI(model="gpt-3.5-turbo", temperature=0)
+    tools = [repl, ListingSearchTool(), CustomPredictorTool(), CustomBatchPredictorTool(), retriever_tool]
+    if prompt_mode == "compact":
+        tools.append(ListValuesTool())
+
+    # Callbacks given to the executor don't reach its children, the tracer is attached to each of them
+    callbacks = [tracer] if tracer is not None else None
+    for tool in tools:
+        tool.callbacks = callbacks
+
+    # Tokens are streamed to the callbacks as they arrive, the executor still gets the whole message
+    llm = ChatOpenAI(model="gpt-3.5-turbo", temperature=0, streaming=True, callbacks=callbacks,
+                     openai_api_key=api_key)
     llm_with_tools = llm.bind(functions=[format_tool_to_openai_function(t) for t in tools])
+    inputs = {
+        "input": lambda x: x["input"],
+        "agent_scratchpad": lambda x: format_to_openai_function_messages(
+            x["intermediate_steps"]
+        ),
+        "agent_memory": lambda x: x["agent_memory"],
+    }
+    if prompt_mode == "compact":
+        inputs["value_hints"] = lambda x: value_hints(x["input"])
     agent = (
-            {
-                "input": lambda x: x["input"],
-                "agent_scratchpad": lambda x: format_to_openai_function_messages(
-                    x["intermediate_steps"]
-                ),
-                "agent_memory": lambda x: x["agent_memory"],
-            }
+            inputs
             | prompt
             | llm_with_tools
             | OpenAIFunctionsAgentOutputParser()
@@ -80,24 +134,181 @@ def get_chain(conversation_preferences='None'):
     return agent_executor
 
 
+_loop = None
+_loop_lock = threading.Lock()
+
+
+def get_agent_loop():
+    """Event loop running the agent turns of every session, in a background thread."""
+    global _loop
+    if _loop is None:
+        with _loop_lock:
+            if _loop is None:
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name="agent-loop", daemon=True).start()
+                _loop = loop
+    return _loop
+
+
+class TokenQueueHandler(BaseCallbackHandler):
+    """Put the tokens of the model's answers in a queue, for another thread to consume."""
+
+    # Called on the event loop, in order, instead of in executor threads
+    run_inline = True
+
+    def __init__(self, tokens: queue.Queue):
+        self.tokens = tokens
+
+    def on_llm_new_token(self, token: str, **kwargs) -> None:
+        # Function call chunks have no content, only the text meant for the user is streamed
+        if token:
+            self.tokens.put(token)
+
+
 class AutoMentorChatbot:
-    def __init__(self, conversation_preferences='None'):
-        self.agent = get_chain(conversation_preferences)
+    def __init__(self, conversation_preferences='None', summarize_listings=False, prompt_mode=PROMPT_MODE,
+                 api_key=None):
+        # The user's own API key, every model and embedding call of the session is made with it
+        self.api_key = api_key or os.environ.get("OPENAI_API_KEY")
+        self.embeddings = get_embeddings(self.api_key)
+        # Spans of the model, tool and retriever calls of this session
+        self.tracer = TracingHandler()
+        self.agent = get_chain(conversation_preferences, prompt_mode, self.tracer, self.api_key)
+        self.conversation_preferences = conversation_preferences
+        # Word the "tell me more about car N" answers with one model call instead of the template
+        self.summarize_listings = summarize_listings
         self.agent_memory = []
         self.chat_history = []
 
-    def generate_response(self, message: str):
-        result = self.agent.invoke({'input': message, 'agent_memory': self.agent_memory})
+    def _summary_messages(self, listing_markdown: str):
+        return [SystemMessage(content=f"Conversation Preferences: {self.conversation_preferences}\n\n"
+                                      f"You are a dedicated automotive assistant. Describe the following car "
+                                      f"listing to the user in one paragraph, ending with its link."),
+                HumanMessage(content=listing_markdown)]
+
+    def summarize_listing(self, listing_markdown: str):
+        llm = ChatOpenAI(model="gpt-3.5-turbo", temperature=0, openai_api_key=self.api_key)
+        return llm.invoke(self._summary_messages(listing_markdown)).content
+
+    async def asummarize_listing(self, listing_markdown: str):
+        llm = ChatOpenAI(model="gpt-3.5-turbo", temperature=0, openai_api_key=self.api_key)
+        return (await llm.ainvoke(self._summary_messages(listing_markdown))).content
+
+    def _embed_question(self, message: str):
+        # The semantic tier of the response cache only reads embeddings, the question is embedded with this
+        # session's key before the model call looks it up
+        if RESPONSE_CACHE_ENABLED and SEMANTIC_CACHE_ENABLED:
+            try:
+                self.embeddings.embed_query(message)
+            except Exception:
+                pass
+
+    async def _aembed_question(self, message: str):
+        if RESPONSE_CACHE_ENABLED and SEMANTIC_CACHE_ENABLED:
+            try:
+                await self.embeddings.aembed_query(message)
+            except Exception:
+                pass
+
+    def _remember(self, message: str, output: str):
         self.agent_memory.extend(
             [
                 HumanMessage(content=message),
-                AIMessage(content=result["output"]),
+                AIMessage(content=output),
             ]
         )
         if len(self.agent_memory) > 4:
             self.agent_memory = self.agent_memory[-4:]
+
+    def generate_response(self, message: str):
+        self.tracer.start_turn(message)
+        try:
+            # Simple intents (e.g. "tell me more about car 8342") are answered from the listing store directly
+            output = answer_simple_intent(message, self.summarize_listing if self.summarize_listings else None)
+            if output is None:
+                self._embed_question(message)
+                output = self.agent.invoke({'input': message, 'agent_memory': self.agent_memory})['output']
+        except Exception as e:
+            self.tracer.end_turn(error=e)
+            raise
+
+        self.tracer.end_turn(output)
+        self._remember(message, output)
+        return output
+
+    async def _arun_agent(self, message: str, callbacks=None):
+        await self._aembed_question(message)
+        try:
+            result = await asyncio.wait_for(
+                self.agent.ainvoke({'input': message, 'agent_memory': self.agent_memory},
+                                   config={'callbacks': callbacks}),
+                AGENT_TIMEOUT,
+            )
+        except asyncio.TimeoutError:
+            return AGENT_TIMEOUT_MESSAGE
         return result['output']
 
+    async def agenerate_response(self, message: str):
+        """Asynchronous generate_response, the agent turn is cancelled along with the calling task."""
+        self.tracer.start_turn(message)
+        try:
+            # Runs on the agent loop shared by the sessions, the summary model call is awaited instead of blocking it
+            output = await aanswer_simple_intent(message,
+                                                 self.asummarize_listing if self.summarize_listings else None)
+            if output is None:
+                output = await self._arun_agent(message)
+        except BaseException as e:
+            self.tracer.end_turn(error=e)
+            raise
+
+        self.tracer.end_turn(output)
+        self._remember(message, output)
+        return output
+
+    def stream_response(self, message: str):
+        """
+        Yield the answer token by token as the model generates it, the generator returns the whole answer.
+
+        The agent runs on the shared agent event loop, so the script thread only waits for tokens, and it is
+        cancelled if the generator is closed before the end (e.g. the user left the page). Answers that don't come
+        from the model (fast path, tools returning directly) are yielded in one piece, so the caller should render
+        the returned answer once the stream is over.
+        """
+        self.tracer.start_turn(message)
+        try:
+            output = answer_simple_intent(message, self.summarize_listing if self.summarize_listings else None)
+        except BaseException as e:
+            self.tracer.end_turn(error=e)
+            raise
+        if output is not None:
+            self.tracer.end_turn(output)
+            yield output
+            self._remember(message, output)
+            return output
+
+        tokens = queue.Queue()
+        future = asyncio.run_coroutine_threadsafe(self._arun_agent(message, [TokenQueueHandler(tokens)]),
+                                                  get_agent_loop())
+        future.add_done_callback(lambda _: tokens.put(None))
+
+        streamed = []
+        try:
+            while (token := tokens.get()) is not None:
+                streamed.append(token)
+                yield token
+            output = future.result()
+        except BaseException as e:
+            future.cancel()
+            self.tracer.end_turn(error=e)
+            raise
+
+        self.tracer.end_turn(output)
+        if not streamed:
+            yield output
+
+        self._remember(message, output)
+        return output
+
     def __str__(self):
         class_name = str(type(self)).split('.')[-1].replace("'>", "")
         return f"🤖 {class_name}."
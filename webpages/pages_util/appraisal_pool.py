@@ -0,0 +1,168 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
+
+POOL_WORKERS = 2
+# Appraisals allowed to wait for a free worker before new ones are rejected
+POOL_MAX_PENDING = 8
+POOL_TIMEOUT = 30
+
+WARMUP_CAR = {"year": 2015, "kilometers": 100000, "displacement_cm3": 1600, "power_hp": 120,
+              "gear_type": "manual", "condition": "used", "fuel": "diesel"}
+
+
+class PoolSaturatedError(Exception):
+    """Raised when a worker pool (appraisals, python_repl queries) already holds as many requests as it can queue."""
+
+
+# Set in a worker process whose warm-up failed, sent back to the pool with the results of the worker
+_warmup_error = None
+
+
+def _warm_worker():
+    """Keep the dataset and the saved appraisal models resident in each worker process."""
+    global _warmup_error
+
+    # A failing initializer would break the whole pool, the worker can still load everything on first use
+    try:
+        import pandas as pd
+        from webpages.pages_util.listing_store import get_listing_store
+        from webpages.pages_util.price_advisor import preload_appraisal_models, to_feature_frame, warm_up_appraisal
+
+        get_listing_store()
+        # Compiles umap's numba functions, loading the cacheable ones from NUMBA_CACHE_DIR (inherited from the server)
+        warm_up_appraisal()
+        appraisal_models = preload_appraisal_models()
+
+        # Run one query so the neighbour search is compiled before the first real request
+        if appraisal_models:
+            appraisal_models[0].kneighbors(to_feature_frame(pd.DataFrame([WARMUP_CAR])))
+    except Exception as e:
+        logging.exception("Appraisal worker %s failed to warm up", os.getpid())
+        _warmup_error = repr(e)
+
+
+def _ping():
+    return True
+
+
+def _call(fn):
+    """Run fn in the worker, returning its result along with the worker's pid and warm-up error."""
+    return os.getpid(), _warmup_error, fn()
+
+
+class AppraisalPool:
+    """Bounded process pool running the CPU-bound appraisal work off the event loop."""
+
+    def __init__(self, max_workers=POOL_WORKERS, max_pending=POOL_MAX_PENDING, timeout=POOL_TIMEOUT):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self.in_flight = 0
+        self.completed = 0
+        self.rejected = 0
+        self.timed_out = 0
+        # Warm-up error of each worker that reported one, by pid
+        self.warmup_errors = {}
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.max_workers,
+                                                     mp_context=multiprocessing.get_context("spawn"),
+                                                     initializer=_warm_worker)
+            return self._executor
+
+    def start(self):
+        """Spawn and warm all the workers ahead of the first appraisal."""
+        executor = self._get_executor()
+        futures = [executor.submit(_call, _ping) for _ in range(self.max_workers)]
+        for future in futures:
+            future.add_done_callback(self._record_warmup)
+        return futures
+
+    def _record_warmup(self, future):
+        if future.cancelled() or future.exception() is not None:
+            return
+        pid, warmup_error, _ = future.result()
+        if warmup_error is not None:
+            with self._lock:
+                self.warmup_errors[pid] = warmup_error
+
+    def _release(self, future):
+        with self._lock:
+            self.in_flight -= 1
+            self.completed += 1
+
+    async def run(self, fn, *args, **kwargs):
+        """Run fn in a worker, rejecting the call when the queue is full and giving up after the timeout."""
+        executor = self._get_executor()
+
+        with self._lock:
+            if self.in_flight >= self.max_workers + self.max_pending:
+                self.rejected += 1
+                raise PoolSaturatedError(f"{self.in_flight} appraisals already running or queued")
+            self.in_flight += 1
+
+        # The slot is only released once the worker is done, even if the caller stopped waiting
+        try:
+            future = executor.submit(_call, partial(fn, *args, **kwargs))
+        except Exception:
+            with self._lock:
+                self.in_flight -= 1
+            raise
+        future.add_done_callback(self._release)
+        future.add_done_callback(self._record_warmup)
+
+        try:
+            _, _, result = await asyncio.wait_for(asyncio.wrap_future(future), timeout=self.timeout)
+            return result
+        except asyncio.TimeoutError:
+            with self._lock:
+                self.timed_out += 1
+            raise
+        except BrokenProcessPool:
+            # A worker died (e.g. out of memory), start a fresh pool for the next requests
+            with self._lock:
+                if self._executor is executor:
+                    self._executor = None
+            raise
+
+    def stats(self):
+        """Pool saturation metrics: busy workers, queued requests and the counters since start."""
+        with self._lock:
+            busy = min(self.in_flight, self.max_workers)
+            return {"workers": self.max_workers,
+                    "busy_workers": busy,
+                    "queued": self.in_flight - busy,
+                    "max_pending": self.max_pending,
+                    "saturation": self.in_flight / (self.max_workers + self.max_pending),
+                    "completed": self.completed,
+                    "rejected": self.rejected,
+                    "timed_out": self.timed_out,
+                    "warmup_failures": len(self.warmup_errors),
+                    "last_warmup_error": next(reversed(self.warmup_errors.values()), None)}
+
+    def __str__(self):
+        stats = self.stats()
+        text = (f"{stats['busy_workers']}/{stats['workers']} busy, {stats['queued']} queued, "
+                f"{stats['rejected']} rejected, {stats['timed_out']} timed out")
+        if stats["warmup_failures"]:
+            text += f", {stats['warmup_failures']} failed warm-ups ({stats['last_warmup_error']})"
+        return text
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+
+
+appraisal_pool = AppraisalPool()
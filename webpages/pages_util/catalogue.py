@@ -0,0 +1,119 @@
+import json
+import os
+import re
+import threading
+import unicodedata
+from webpages.pages_util.util import DATASET_CATALOGUE_PATH, dataset_path, dataset_version
+
+# Categorical columns whose unique values are listed in the catalogue
+CATALOGUE_COLUMNS = ['Advertiser', 'Brand', 'Model', 'Fuel', 'Segment', 'Color', 'Gear_Type', 'Condition',
+                     'Compared_Price']
+
+
+# Columns whose values are matched against the user's query, see Catalogue.match_values
+MATCHED_COLUMNS = ['Advertiser', 'Brand', 'Model', 'Fuel', 'Segment', 'Color', 'Gear_Type', 'Condition']
+MAX_PHRASE_WORDS = 3
+
+
+def normalize_value(value):
+    """Lowercase a value and strip its accents, so 'citroen' matches 'Citroën'."""
+    decomposed = unicodedata.normalize("NFKD", str(value).strip().lower())
+    return "".join(char for char in decomposed if not unicodedata.combining(char))
+
+
+class Catalogue:
+    """Columns of the dataset and the allowed values of each categorical column."""
+
+    def __init__(self, columns, dtypes, categories, version=None):
+        self.columns = columns
+        self.dtypes = dtypes
+        self.categories = categories
+        self.version = version
+        self._lookup = {column: {normalize_value(value): value for value in values}
+                        for column, values in categories.items()}
+        self._phrases = None
+
+    @classmethod
+    def from_dataframe(cls, df, version=None):
+        categories = {column: df[column].dropna().unique().tolist() for column in CATALOGUE_COLUMNS
+                      if column in df.columns}
+        return cls(list(df.columns), {column: str(dtype) for column, dtype in df.dtypes.items()}, categories,
+                   version)
+
+    def allowed_values(self, column):
+        """The unique values of a categorical column, in order of appearance in the dataset."""
+        return self.categories[column]
+
+    def canonical_value(self, column, value):
+        """The catalogue spelling of a value (case and accent insensitive), or None if the value is not allowed."""
+        return self._lookup.get(column, {}).get(normalize_value(value))
+
+    def is_allowed(self, column, value):
+        return self.canonical_value(column, value) is not None
+
+    def values_with_prefix(self, column, prefix=None):
+        """The allowed values of a column starting with a prefix (case and accent insensitive)."""
+        prefix = normalize_value(prefix or "")
+        return [value for value in self.categories[column] if normalize_value(value).startswith(prefix)]
+
+    def match_values(self, text):
+        """
+        The categorical values mentioned in a text, as {column: [values]}.
+
+        Values are matched as whole words, case and accent insensitive, e.g. "a citroen berlingo" mentions the
+        Brand 'Citroën' and the Model 'Berlingo'.
+        """
+        if self._phrases is None:
+            phrases = {}
+            for column in MATCHED_COLUMNS:
+                for value in self.categories.get(column, []):
+                    phrase = " ".join(re.findall(r"\w+", normalize_value(value)))
+                    if len(phrase) >= 2 and len(phrase.split()) <= MAX_PHRASE_WORDS:
+                        phrases.setdefault(phrase, []).append((column, value))
+            self._phrases = phrases
+
+        words = re.findall(r"\w+", normalize_value(text))
+        matches = {}
+        for size in range(1, MAX_PHRASE_WORDS + 1):
+            for start in range(len(words) - size + 1):
+                for column, value in self._phrases.get(" ".join(words[start:start + size]), []):
+                    if value not in matches.setdefault(column, []):
+                        matches[column].append(value)
+        return matches
+
+    def to_dict(self):
+        return {"columns": self.columns, "dtypes": self.dtypes, "categories": self.categories}
+
+
+_catalogue = None
+_catalogue_lock = threading.Lock()
+
+
+def _load_or_build_catalogue(path, version):
+    # The catalogue is written next to the dataset by preprocess.py, it is rebuilt if missing or out of date
+    if os.path.exists(DATASET_CATALOGUE_PATH) and os.path.getmtime(DATASET_CATALOGUE_PATH) >= os.path.getmtime(path):
+        with open(DATASET_CATALOGUE_PATH, encoding="utf-8") as f:
+            data = json.load(f)
+        return Catalogue(data["columns"], data.get("dtypes", {}), data["categories"], version)
+
+    from webpages.pages_util.listing_store import get_listing_store
+    catalogue = Catalogue.from_dataframe(get_listing_store().df, version)
+    try:
+        with open(DATASET_CATALOGUE_PATH, "w", encoding="utf-8") as f:
+            json.dump(catalogue.to_dict(), f, ensure_ascii=False, indent=1, default=str)
+    except OSError:
+        pass
+    return catalogue
+
+
+def get_catalogue():
+    """Return the process-wide catalogue of the current dataset version."""
+    global _catalogue
+    path = dataset_path()
+    version = dataset_version(path)
+
+    if _catalogue is None or _catalogue.version != version:
+        with _catalogue_lock:
+            if _catalogue is None or _catalogue.version != version:
+                _catalogue = _load_or_build_catalogue(path, version)
+    return _catalogue
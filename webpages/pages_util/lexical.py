@@ -0,0 +1,177 @@
+import json
+import os
+import re
+import threading
+from typing import Any, List
+import numpy as np
+from langchain_core.callbacks import AsyncCallbackManagerForRetrieverRun, CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+from webpages.pages_util.catalogue import normalize_value
+from webpages.pages_util.util import VECTORSTORE_PATH
+
+# Written next to the FAISS index by data_generators/vectordatabase/generate_vectordb.py
+LEXICAL_INDEX_FILE = "bm25.json"
+RETRIEVAL_MODES = ["hybrid", "lexical", "dense"]
+RETRIEVAL_MODE = os.environ.get("AUTOMENTOR_RETRIEVAL_MODE", "hybrid")
+STOPWORDS = {"a", "about", "an", "and", "are", "as", "at", "be", "by", "can", "car", "cars", "did", "do", "does",
+             "for", "from", "has", "have", "how", "i", "in", "is", "it", "its", "me", "more", "of", "on", "or", "some",
+             "tell", "that", "the", "their", "them", "they", "this", "to", "was", "were", "what", "when", "which",
+             "who", "with", "you"}
+
+
+def tokenize(text: str):
+    """Lowercase, accent-free word tokens of a text, without stopwords."""
+    return [token for token in re.findall(r"[a-z0-9]+", normalize_value(text)) if token not in STOPWORDS]
+
+
+class BM25Index:
+    """Okapi BM25 over a list of texts, with one posting list (document positions, term frequencies) per term."""
+
+    def __init__(self, texts: List[str], k1=1.5, b=0.75):
+        self.texts = list(texts)
+        self.k1 = k1
+        self.b = b
+
+        postings = {}
+        lengths = np.zeros(len(self.texts))
+        for position, text in enumerate(self.texts):
+            tokens = tokenize(text)
+            lengths[position] = len(tokens)
+            for token in set(tokens):
+                postings.setdefault(token, ([], []))
+                postings[token][0].append(position)
+                postings[token][1].append(tokens.count(token))
+
+        # Document length normalization is the same for every query, it is computed once
+        self.norms = k1 * (1 - b + b * lengths / max(lengths.mean(), 1))
+        self.postings = {}
+        for token, (positions, frequencies) in postings.items():
+            idf = np.log(1 + (len(self.texts) - len(positions) + 0.5) / (len(positions) + 0.5))
+            self.postings[token] = (np.array(positions), np.array(frequencies, dtype=float), idf)
+
+    def scores(self, query: str):
+        """BM25 score of every document for a query."""
+        scores = np.zeros(len(self.texts))
+        for token in set(tokenize(query)):
+            if token in self.postings:
+                positions, frequencies, idf = self.postings[token]
+                scores[positions] += idf * frequencies * (self.k1 + 1) / (frequencies + self.norms[positions])
+        return scores
+
+    def search(self, query: str, k=4):
+        """Positions and scores of the k best documents with a positive score."""
+        scores = self.scores(query)
+        top = np.argsort(-scores, kind="stable")[:k]
+        top = top[scores[top] > 0]
+        return top.tolist(), scores[top].tolist()
+
+    def save(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"texts": self.texts, "k1": self.k1, "b": self.b}, f, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        return cls(data["texts"], data["k1"], data["b"])
+
+
+def faiss_texts(vectorstore):
+    """Texts of a FAISS vectorstore, in the order of its index."""
+    return [vectorstore.docstore.search(vectorstore.index_to_docstore_id[i]).page_content
+            for i in range(vectorstore.index.ntotal)]
+
+
+_lexical_index = None
+_lexical_index_lock = threading.Lock()
+
+
+def get_lexical_index(vectorstore):
+    """
+    Return the BM25 index of the vectorstore chunks, loaded from LEXICAL_INDEX_FILE or, when it is missing or out of
+    date, built from the FAISS docstore.
+    """
+    global _lexical_index
+    if _lexical_index is None:
+        with _lexical_index_lock:
+            if _lexical_index is None:
+                path = os.path.join(VECTORSTORE_PATH, LEXICAL_INDEX_FILE)
+                index = BM25Index.load(path) if os.path.exists(path) else None
+                if index is None or len(index.texts) != vectorstore.index.ntotal:
+                    index = BM25Index(faiss_texts(vectorstore))
+                _lexical_index = index
+    return _lexical_index
+
+
+class HybridRetriever(BaseRetriever):
+    """
+    Retriever combining the BM25 and FAISS scores of the chunks.
+
+    Modes: "hybrid" sums the min-max normalized scores of both retrievers (weighted by alpha for BM25), "lexical"
+    only uses BM25 and never calls the embedding model, "dense" only uses FAISS. The hybrid mode falls back to BM25
+    when the query can't be embedded. Queries are embedded with `embeddings` (e.g. bound to the session's API key),
+    or with the embedding function of the vectorstore if None.
+    """
+
+    vectorstore: Any
+    lexical: Any
+    embeddings: Any = None
+    mode: str = "hybrid"
+    k: int = 4
+    alpha: float = 0.5
+
+    def _documents(self, positions):
+        return [self.vectorstore.docstore.search(self.vectorstore.index_to_docstore_id[position])
+                for position in positions]
+
+    @property
+    def _embeddings(self):
+        return self.embeddings if self.embeddings is not None else self.vectorstore.embedding_function
+
+    def _dense_scores(self, query, embedding=None):
+        if embedding is None:
+            embedding = self._embeddings.embed_query(query)
+        distances, positions = self.vectorstore.index.search(np.array([embedding], dtype=np.float32),
+                                                             self.vectorstore.index.ntotal)
+        scores = np.zeros(self.vectorstore.index.ntotal)
+        # Smaller distances are better
+        scores[positions[0]] = -distances[0]
+        return scores
+
+    def _combine(self, query, dense):
+        if self.mode == "dense":
+            return self._documents(np.argsort(-dense, kind="stable")[:self.k].tolist())
+
+        def normalize(scores):
+            spread = scores.max() - scores.min()
+            return (scores - scores.min()) / spread if spread > 0 else np.zeros_like(scores)
+
+        scores = self.alpha * normalize(self.lexical.scores(query)) + (1 - self.alpha) * normalize(dense)
+        return self._documents(np.argsort(-scores, kind="stable")[:self.k].tolist())
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        if self.mode == "lexical":
+            return self._documents(self.lexical.search(query, self.k)[0])
+
+        try:
+            dense = self._dense_scores(query)
+        except Exception:
+            if self.mode == "dense":
+                raise
+            return self._documents(self.lexical.search(query, self.k)[0])
+        return self._combine(query, dense)
+
+    async def _aget_relevant_documents(self, query: str, *,
+                                       run_manager: AsyncCallbackManagerForRetrieverRun) -> List[Document]:
+        # Only the embedding is awaited, the searches take well under a millisecond
+        if self.mode == "lexical":
+            return self._documents(self.lexical.search(query, self.k)[0])
+
+        try:
+            dense = self._dense_scores(query, await self._embeddings.aembed_query(query))
+        except Exception:
+            if self.mode == "dense":
+                raise
+            return self._documents(self.lexical.search(query, self.k)[0])
+        return self._combine(query, dense)
@@ -0,0 +1,242 @@
+import threading
+import numpy as np
+import pandas as pd
+from typing import Optional, Type
+from langchain.callbacks.manager import (
+    AsyncCallbackManagerForToolRun,
+    CallbackManagerForToolRun,
+)
+from langchain.pydantic_v1 import BaseModel, Field
+from langchain.tools import BaseTool
+from webpages.pages_util.catalogue import get_catalogue, normalize_value
+from webpages.pages_util.listing_store import get_listing_store
+from webpages.pages_util.photo_cache import get_photo_cache
+
+# Tool argument -> dataset column
+CATEGORICAL_FILTERS = {"brand": "Brand", "model": "Model", "fuel": "Fuel", "segment": "Segment", "color": "Color",
+                       "gear_type": "Gear_Type", "condition": "Condition", "advertiser": "Advertiser"}
+RANGE_FILTERS = {"price": "Price_EUR", "year": "Year", "kilometers": "Kilometers", "power_hp": "Power_hp"}
+SORT_OPTIONS = {"price_asc": ("Price_EUR", False), "price_desc": ("Price_EUR", True),
+                "year_desc": ("Year", True), "kilometers_asc": ("Kilometers", False)}
+
+
+class ListingIndex:
+    """
+    Precomputed indexes over the listings.
+
+    Categorical columns keep a posting list (sorted row positions) per normalized value plus the value code of every
+    row. Numeric columns keep their values sorted along with the row positions. A search starts from the most
+    selective filter and checks the remaining ones on its candidates only.
+    """
+
+    def __init__(self, df, version=None):
+        self.version = version
+        self.ids = df.index.to_numpy()
+
+        self.codes = {}
+        self.value_codes = {}
+        self.postings = {}
+        for column in CATEGORICAL_FILTERS.values():
+            normalized = df[column].astype("string").map(normalize_value, na_action="ignore")
+            codes, uniques = pd.factorize(normalized)
+            self.codes[column] = codes
+            self.value_codes[column] = {value: code for code, value in enumerate(uniques)}
+
+            # Split the stable argsort by code to get one sorted posting list per value
+            order = np.argsort(codes, kind="stable")
+            counts = np.bincount(codes[codes >= 0], minlength=len(uniques))
+            starts = np.searchsorted(codes[order], 0)
+            self.postings[column] = np.split(order[starts:], np.cumsum(counts)[:-1])
+
+        self.values = {}
+        self.sorted_values = {}
+        self.sorted_positions = {}
+        for column in RANGE_FILTERS.values():
+            values = pd.to_numeric(df[column], errors="coerce").astype(float).to_numpy()
+            order = np.argsort(values, kind="stable")
+            order = order[~np.isnan(values[order])]
+            self.values[column] = values
+            self.sorted_values[column] = values[order]
+            self.sorted_positions[column] = order
+
+    def _posting(self, column, value):
+        code = self.value_codes[column].get(normalize_value(value))
+        return self.postings[column][code] if code is not None else np.empty(0, dtype=np.int64)
+
+    def search(self, equals=None, ranges=None, limit=3, sort_by=None):
+        """
+        Return the total number of matches and the ids of the first `limit` ones.
+
+        equals: {column: value} exact (case and accent insensitive) matches on categorical columns
+        ranges: {column: (minimum, maximum)} inclusive bounds on numeric columns, either bound may be None
+        sort_by: one of SORT_OPTIONS, the dataset order is kept otherwise
+        """
+        equals = equals or {}
+        ranges = ranges or {}
+
+        # Candidate sets with their sizes, the smallest one seeds the search
+        seeds = []
+        for column, value in equals.items():
+            posting = self._posting(column, value)
+            seeds.append((len(posting), "equals", column, posting))
+        for column, (minimum, maximum) in ranges.items():
+            sorted_values = self.sorted_values[column]
+            low = 0 if minimum is None else np.searchsorted(sorted_values, minimum, side="left")
+            high = len(sorted_values) if maximum is None else np.searchsorted(sorted_values, maximum, side="right")
+            seeds.append((max(high - low, 0), "range", column, (low, high)))
+
+        if not seeds:
+            candidates = np.arange(len(self.ids))
+        else:
+            seeds.sort(key=lambda seed: seed[0])
+            _, kind, seed_column, seed = seeds[0]
+            if kind == "equals":
+                candidates = seed
+            else:
+                low, high = seed
+                candidates = np.sort(self.sorted_positions[seed_column][low:high])
+
+            for _, kind, column, _ in seeds[1:]:
+                if kind == "equals":
+                    code = self.value_codes[column].get(normalize_value(equals[column]), -2)
+                    candidates = candidates[self.codes[column][candidates] == code]
+                else:
+                    minimum, maximum = ranges[column]
+                    values = self.values[column][candidates]
+                    keep = ~np.isnan(values)
+                    if minimum is not None:
+                        keep &= values >= minimum
+                    if maximum is not None:
+                        keep &= values <= maximum
+                    candidates = candidates[keep]
+
+        if sort_by:
+            column, descending = SORT_OPTIONS[sort_by]
+            values = self.values[column][candidates]
+            order = np.argsort(-values if descending else values, kind="stable")
+            candidates = candidates[order[~np.isnan(values[order])]]
+
+        return len(candidates), self.ids[candidates[:limit]].tolist()
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_listing_index():
+    """Return the process-wide listing index, rebuilt along with the listing store."""
+    global _index
+    store = get_listing_store()
+
+    if _index is None or _index.version != store.version:
+        with _index_lock:
+            if _index is None or _index.version != store.version:
+                _index = ListingIndex(store.df, store.version)
+    return _index
+
+
+class ListingSearchInput(BaseModel):
+    brand: Optional[str] = Field(None, description="brand of the car, e.g. 'BMW'")
+    model: Optional[str] = Field(None, description="model of the car, e.g. '520'")
+    fuel: Optional[str] = Field(None, description="type of fuel of the car")
+    segment: Optional[str] = Field(None, description="segment of the car, e.g. 'SUV'")
+    color: Optional[str] = Field(None, description="color of the car")
+    gear_type: Optional[str] = Field(None, description="gear type of the car")
+    condition: Optional[str] = Field(None, description="used or new car")
+    advertiser: Optional[str] = Field(None, description="professional or private advertiser")
+    min_price: Optional[int] = Field(None, description="minimum price in euros")
+    max_price: Optional[int] = Field(None, description="maximum price in euros")
+    min_year: Optional[int] = Field(None, description="minimum year of the car")
+    max_year: Optional[int] = Field(None, description="maximum year of the car")
+    min_kilometers: Optional[int] = Field(None, description="minimum kilometers of the car")
+    max_kilometers: Optional[int] = Field(None, description="maximum kilometers of the car")
+    min_power_hp: Optional[int] = Field(None, description="minimum horsepower of the car")
+    max_power_hp: Optional[int] = Field(None, description="maximum horsepower of the car")
+    sort_by: Optional[str] = Field(None, description=f"optional order of the results, one of {list(SORT_OPTIONS)}")
+    limit: int = Field(3, description="maximum number of listings to return")
+
+
+def search_listings(**filters):
+    """Run a listing search with the ListingSearchInput arguments and describe the result for the agent."""
+    catalogue = get_catalogue()
+
+    equals = {}
+    for argument, column in CATEGORICAL_FILTERS.items():
+        value = filters.get(argument)
+        if value is None:
+            continue
+        if not catalogue.is_allowed(column, value):
+            allowed = catalogue.allowed_values(column)
+            return f"Unknown {argument} '{value}'. Allowed values: {allowed[:30]}"
+        equals[column] = value
+
+    ranges = {}
+    for argument, column in RANGE_FILTERS.items():
+        minimum, maximum = filters.get(f"min_{argument}"), filters.get(f"max_{argument}")
+        if minimum is not None or maximum is not None:
+            ranges[column] = (minimum, maximum)
+
+    sort_by = filters.get("sort_by")
+    if sort_by is not None and sort_by not in SORT_OPTIONS:
+        return f"Unknown sort_by '{sort_by}'. Allowed values: {list(SORT_OPTIONS)}"
+
+    total, listing_ids = get_listing_index().search(equals, ranges, limit=filters.get("limit") or 3, sort_by=sort_by)
+    if not total:
+        return "No listings match these filters."
+    # The listings are likely to be shown, their photos are downloaded while the agent writes the answer
+    get_photo_cache().prefetch(listing_ids)
+    return f"Found {total} matching listings. Here are the indexes of {len(listing_ids)} of them: {listing_ids}"
+
+
+class ListingSearchTool(BaseTool):
+    name = "listing_search"
+    description = ("useful for when you need to search for car listings by brand, model, fuel, segment, color, "
+                   "gear type, condition, advertiser, price, year, kilometers or horsepower")
+    args_schema: Type[BaseModel] = ListingSearchInput
+
+    def _run(self, run_manager: Optional[CallbackManagerForToolRun] = None, **filters) -> str:
+        """Use the tool."""
+        return search_listings(**filters)
+
+    async def _arun(self, run_manager: Optional[AsyncCallbackManagerForToolRun] = None, **filters) -> str:
+        """Use the tool asynchronously."""
+        return search_listings(**filters)
+
+
+# Longer lists are cut, the agent can narrow them down with a prefix
+MAX_LISTED_VALUES = 50
+
+
+class ListValuesInput(BaseModel):
+    column: str = Field(description="categorical column of the dataframe, e.g. 'Brand'")
+    prefix: Optional[str] = Field(None, description="optional beginning of the values, e.g. 'Mer'")
+
+
+def list_values(column, prefix=None):
+    """Describe the allowed values of a categorical column for the agent."""
+    catalogue = get_catalogue()
+    if column not in catalogue.categories:
+        return f"Unknown column '{column}'. Categorical columns: {list(catalogue.categories)}"
+
+    values = catalogue.values_with_prefix(column, prefix)
+    if not values:
+        return f"No {column} value starts with '{prefix}'."
+    if len(values) > MAX_LISTED_VALUES:
+        return f"{values[:MAX_LISTED_VALUES]} and {len(values) - MAX_LISTED_VALUES} more, use a longer prefix."
+    return str(values)
+
+
+class ListValuesTool(BaseTool):
+    name = "list_values"
+    description = "useful for when you need the allowed values of a categorical column, optionally starting with a prefix"
+    args_schema: Type[BaseModel] = ListValuesInput
+
+    def _run(self, column: str, prefix: Optional[str] = None,
+             run_manager: Optional[CallbackManagerForToolRun] = None) -> str:
+        """Use the tool."""
+        return list_values(column, prefix)
+
+    async def _arun(self, column: str, prefix: Optional[str] = None,
+                    run_manager: Optional[AsyncCallbackManagerForToolRun] = None) -> str:
+        """Use the tool asynchronously."""
+        return list_values(column, prefix)
@@ -0,0 +1,83 @@
+import threading
+import numpy as np
+import pandas as pd
+from webpages.pages_util.util import DATASET_COLUMNAR_PATH, dataset_path, dataset_version
+
+
+def _make_read_only(df):
+    """Flag the arrays backing df as read-only, so an in-place write raises instead of changing the shared listings."""
+    for values in df._mgr.arrays:
+        # Numpy blocks, and the codes/values and masks of the categorical and nullable integer columns
+        for array in [values, getattr(values, "_ndarray", None), getattr(values, "_data", None),
+                      getattr(values, "_mask", None)]:
+            if isinstance(array, np.ndarray):
+                array.flags.writeable = False
+    return df
+
+
+class ListingStore:
+    """Read-only car listings, loaded once and shared by every session of the server process."""
+
+    def __init__(self, df, version):
+        self.df = _make_read_only(df)
+        self.version = version
+
+        # Lowercase brand/model keys used to select the appraisal groups
+        self._brand_keys = df["Brand"].astype(str).str.lower().to_numpy()
+        self._model_keys = df["Model"].astype(str).str.lower().to_numpy()
+
+        # The store never changes, its footprint is measured once instead of on every rerun of the chat page
+        keys = sum(sum(len(key) for key in keys) + keys.nbytes for keys in [self._brand_keys, self._model_keys])
+        self._memory_usage = int(df.memory_usage(deep=True).sum()) + keys
+
+    def view(self):
+        """
+        A read-only view of the listings, safe to hand to code that may modify it: columns can be added to or dropped
+        from the view, writing to the listings' values raises ValueError.
+        """
+        return self.df.copy(deep=False)
+
+    def select_brand_model(self, brand, model):
+        """Listings of a brand/model, case insensitive."""
+        mask = (self._brand_keys == brand.lower()) & (self._model_keys == model.lower())
+        return self.df[mask]
+
+    def memory_usage(self):
+        """Bytes held by the listings and the lookup keys."""
+        return self._memory_usage
+
+    def __len__(self):
+        return len(self.df)
+
+    def __str__(self):
+        return f"{len(self)} listings, {self.memory_usage() / 1024 ** 2:.1f} MB"
+
+
+def read_dataset(path):
+    """Read the columnar export memory-mapped (categoricals and small integers restored) or the CSV."""
+    if path == DATASET_COLUMNAR_PATH:
+        import pyarrow.feather as feather
+        return feather.read_table(path, memory_map=True).to_pandas()
+    return pd.read_csv(path, index_col=0)
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_listing_store():
+    """Return the process-wide listing store, reloading it only when the dataset file changes."""
+    global _store
+    path = dataset_path()
+    version = dataset_version(path)
+
+    if _store is None or _store.version != version:
+        with _store_lock:
+            if _store is None or _store.version != version:
+                _store = ListingStore(read_dataset(path), version)
+    return _store
+
+
+def get_listings():
+    """Shortcut to the shared listings DataFrame."""
+    return get_listing_store().df
@@ -1,42 +1,57 @@
 import streamlit as st
-import hmac
-import os
-from openai import OpenAI, AuthenticationError
-import pandas as pd
-from webpages.pages_util.util import CUSTOMER_DATA_PATH
+import hashlib
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from openai import OpenAI, APIError, AuthenticationError
+from webpages.pages_util.user_store import UserExistsError, get_user_store
 
+# Seconds a key checked with the API stays trusted (or rejected) before it is checked again
+VALID_KEY_TTL = 3600
+INVALID_KEY_TTL = 60
+API_KEY_CHECK_TIMEOUT = 10
 
-def is_valid_api_key(api_key):
-    messages = [{"role": "user", "content": "Hello!"}]
+# SHA-256 fingerprint of the key: (valid, expiry time), the keys themselves are never kept
+_checked_keys = {}
+_checked_keys_lock = threading.Lock()
+# Runs the key checks while the credentials are being verified
+_key_check_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="api-key-check")
 
-    try:
-        client = OpenAI(api_key=api_key)
-        completion = client.chat.completions.create(
-            model="gpt-3.5-turbo-1106",
-            messages=messages,
-        )
-        return True
-    except AuthenticationError as e:
-        return False
 
+def key_fingerprint(api_key):
+    return hashlib.sha256(api_key.encode()).hexdigest()
 
-def login():
-    """Returns True if the password is correct, otherwise returns False."""
 
-    def load_user_data():
-        """Load user data from a CSV file using pandas."""
-        user_data = {}
-        credentials = {}
+def is_valid_api_key(api_key):
+    """
+    Check an API key by listing the models, which costs no tokens, and remember the answer for a while.
+
+    Raises openai.APIError when the key can't be checked (connection error, rate limit, server error), the answer
+    isn't remembered then.
+    """
+    fingerprint = key_fingerprint(api_key)
+    now = time.monotonic()
+    with _checked_keys_lock:
+        cached = _checked_keys.get(fingerprint)
+    if cached is not None and cached[1] > now:
+        return cached[0]
+
+    try:
+        client = OpenAI(api_key=api_key, max_retries=0, timeout=API_KEY_CHECK_TIMEOUT)
+        client.models.list()
+        valid = True
+    except AuthenticationError:
+        valid = False
 
-        customer_data = pd.read_csv(CUSTOMER_DATA_PATH)
+    with _checked_keys_lock:
+        for stale in [key for key, (_, expiry) in _checked_keys.items() if expiry <= now]:
+            del _checked_keys[stale]
+        _checked_keys[fingerprint] = (valid, now + (VALID_KEY_TTL if valid else INVALID_KEY_TTL))
+    return valid
 
-        for index, row in customer_data.iterrows():
-            credentials[row['Username']] = row['Password']
-            user_data[row['Username']] = {'Email': row['Email'], 'Username': row['Username'],
-                                          'Full Name': row['Full Name'], 'Age': row['Age'],
-                                          'Location': row['Location'], 'Bot Preferences': row['Bot Preferences']}
 
-        return credentials, user_data
+def login():
+    """Returns True if the password is correct, otherwise returns False."""
 
     def login_form():
         """Form with widgets to collect user information"""
@@ -44,28 +59,34 @@ def login():
             username = st.text_input("Username", key="username")
             password = st.text_input("Password", type="password", key="password")
 
-            api_key = st.text_input("Enter your GPT API key", type="password")
-            os.environ["OPENAI_API_KEY"] = api_key.lstrip('"').rstrip('"')
+            api_key = st.text_input("Enter your GPT API key", type="password").lstrip('"').rstrip('"')
 
             if st.form_submit_button("Log in") and username and password and api_key:
-                if is_valid_api_key(api_key):
-                    password_entered()
-                else:
-                    st.warning("Invalid API key. Please enter a valid GPT API key.")
+                # The key is checked with the API while the credentials are verified
+                password_entered(api_key, _key_check_executor.submit(is_valid_api_key, api_key))
             else:
                 st.warning("Please enter all credentials.")
 
-    def password_entered():
+    def password_entered(api_key, key_check):
         """Checks whether a password entered by the user is correct."""
-        credentials, user_data = load_user_data()  # because we use st.stop, even if this was run outside of check_password, this would always be re-executed if password was incorrect, so I left it here for easier reading
-        if st.session_state["username"] in credentials and hmac.compare_digest(
-                st.session_state["password"],
-                credentials[st.session_state["username"]],
-        ):
+        # A single indexed lookup of the username, the password is compared in constant time
+        user_data = get_user_store().authenticate(st.session_state["username"], st.session_state["password"])
+        if user_data is not None:
+            try:
+                valid = key_check.result()
+            except APIError:
+                st.warning("Couldn't reach OpenAI to check the API key. Please try again in a moment.")
+                return
+            if not valid:
+                st.warning("Invalid API key. Please enter a valid GPT API key.")
+                return
+
             st.session_state["logged_in"] = True
             del st.session_state["password"]  # Don't store the password.
 
-            st.session_state["user_data"] = user_data[st.session_state["username"]]
+            st.session_state["user_data"] = user_data
+            # The session's models are created with this key, whatever other users set in the environment
+            st.session_state["api_key"] = api_key
             st.session_state["logging_in"] = False
             st.rerun()
         else:
@@ -108,25 +129,18 @@ def signup():
     def info_submitted(email, username, password, repeat_password, full_name, age, location, bot_preferences):
         """Process the submitted information."""
         # Check if all fields are filled and passwords match
-        customer_data = pd.read_csv(CUSTOMER_DATA_PATH)
         if password != repeat_password or len(password) < 5:
             st.error('Passwords do not match or are too short. Please try again.')
-        elif username in customer_data['Username'].values:
-            st.error('Username is already taken. Please choose a different one.')
-        elif email in customer_data['Email'].values:
-            st.error('Email is already taken. Please choose a different one.')
-
+            return
+
+        new_user = {'Full Name': full_name, 'Username': username, 'Email': email, 'Password': password,
+                    'Age': age, 'Location': location, 'Bot Preferences': bot_preferences}
+        try:
+            # The username and email are checked in the insert's transaction, two signups can't both get them
+            get_user_store().create(new_user)
+        except UserExistsError as e:
+            st.error(f'{e.field} is already taken. Please choose a different one.')
         else:
-            # Insert new row into the customer_data DataFrame
-            new_row = {'Full Name': full_name, 'Username': username, 'Email': email, 'Password': password,
-                       'Age': age, 'Location': location, 'Favorites': [],
-                       'Bot Preferences': bot_preferences}
-
-            customer_data = pd.concat([customer_data, pd.DataFrame([new_row])], ignore_index=True)
-
-            # Save the updated DataFrame to the CSV file
-            customer_data.to_csv(CUSTOMER_DATA_PATH, index=False)
-
             st.session_state['signup_successful'] = True
             st.session_state["signing_up"] = False
             st.session_state["logging_in"] = True
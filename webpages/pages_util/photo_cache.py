@@ -0,0 +1,186 @@
+import io
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from PIL import Image
+from webpages.pages_util.listing_store import get_listing_store
+from webpages.pages_util.util import PHOTO_CACHE_DIR
+
+THUMBNAIL_SIZE = (400, 300)
+THUMBNAIL_QUALITY = 85
+PHOTO_CACHE_MAX_BYTES = int(os.environ.get("AUTOMENTOR_PHOTO_CACHE_MAX_BYTES", 100 * 1024 * 1024))
+PREFETCH_WORKERS = 4
+FETCH_TIMEOUT = 10
+# Seconds a failed download is remembered before the photo is tried again
+FAILURE_TTL = 600
+# Value of the Photo column when the listing has no photo
+NO_PHOTO = 'Não disponível'
+
+
+def make_thumbnail(content: bytes):
+    """Resize an image to fit THUMBNAIL_SIZE and encode it as JPEG."""
+    image = Image.open(io.BytesIO(content))
+    image.thumbnail(THUMBNAIL_SIZE)
+    output = io.BytesIO()
+    image.convert("RGB").save(output, format="JPEG", quality=THUMBNAIL_QUALITY)
+    return output.getvalue()
+
+
+class PhotoCache:
+    """
+    Thumbnails of the listing photos, stored on disk as {listing_id}.jpg and evicted least recently used first once
+    they take more than max_bytes.
+
+    Each photo is fetched once on a background thread, concurrent requests for a photo being fetched share the same
+    download. A failed download is not retried before failure_ttl seconds.
+    """
+
+    def __init__(self, directory=PHOTO_CACHE_DIR, max_bytes=PHOTO_CACHE_MAX_BYTES, workers=PREFETCH_WORKERS,
+                 failure_ttl=FAILURE_TTL):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.failure_ttl = failure_ttl
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="photo-prefetch")
+        # requests.Session isn't thread-safe, each prefetch thread gets its own
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._fetching = {}
+        # Listing id -> time of the last failed download
+        self._failures = {}
+        self.hits = 0
+        self.misses = 0
+
+        # Listing id -> thumbnail size, from the least to the most recently used
+        os.makedirs(directory, exist_ok=True)
+        entries = []
+        for name in os.listdir(directory):
+            stem, extension = os.path.splitext(name)
+            if extension == ".jpg" and stem.isdigit():
+                stat = os.stat(os.path.join(directory, name))
+                entries.append((stat.st_mtime, int(stem), stat.st_size))
+        self._entries = OrderedDict((listing_id, size) for _, listing_id, size in sorted(entries))
+        self.total_bytes = sum(self._entries.values())
+
+    def _path(self, listing_id):
+        return os.path.join(self.directory, f"{listing_id}.jpg")
+
+    def _read(self, listing_id):
+        with self._lock:
+            if listing_id not in self._entries:
+                return None
+            self._entries.move_to_end(listing_id)
+        try:
+            with open(self._path(listing_id), "rb") as f:
+                content = f.read()
+            # The modification time keeps the recency order across restarts
+            os.utime(self._path(listing_id))
+            return content
+        except OSError:
+            with self._lock:
+                self.total_bytes -= self._entries.pop(listing_id, 0)
+            return None
+
+    def _store(self, listing_id, thumbnail):
+        path = self._path(listing_id)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(thumbnail)
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            self.total_bytes += len(thumbnail) - self._entries.pop(listing_id, 0)
+            self._entries[listing_id] = len(thumbnail)
+            while self.total_bytes > self.max_bytes and len(self._entries) > 1:
+                evicted, size = self._entries.popitem(last=False)
+                self.total_bytes -= size
+                try:
+                    os.remove(self._path(evicted))
+                except OSError:
+                    pass
+
+    def _session(self):
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = self._local.session = requests.Session()
+        return session
+
+    def _fetch(self, listing_id, url):
+        try:
+            response = self._session().get(url, timeout=FETCH_TIMEOUT)
+            response.raise_for_status()
+            thumbnail = make_thumbnail(response.content)
+            self._store(listing_id, thumbnail)
+            return thumbnail
+        except Exception:
+            with self._lock:
+                self._failures[listing_id] = time.monotonic()
+            return None
+        finally:
+            with self._lock:
+                self._fetching.pop(listing_id, None)
+
+    def _submit(self, listing_id, url):
+        """Start the download of a photo, or join the one running. Returns None if the photo recently failed."""
+        if not isinstance(url, str) or url == NO_PHOTO:
+            return None
+        # One download per photo, the callers share its future
+        with self._lock:
+            future = self._fetching.get(listing_id)
+            if future is None:
+                failed_at = self._failures.get(listing_id)
+                if failed_at is not None and time.monotonic() - failed_at < self.failure_ttl:
+                    return None
+                self._failures.pop(listing_id, None)
+                future = self.executor.submit(self._fetch, listing_id, url)
+                self._fetching[listing_id] = future
+        return future
+
+    def get(self, listing_id, url):
+        """
+        Return the thumbnail bytes of a listing photo if it is on disk. Otherwise start its download in the background
+        and return None, the caller shows the remote photo meanwhile.
+        """
+        content = self._read(listing_id)
+        if content is not None:
+            self.hits += 1
+            return content
+        self.misses += 1
+        self._submit(listing_id, url)
+        return None
+
+    def fetch(self, listing_id, url):
+        """Return the thumbnail bytes of a listing photo, waiting for its download if needed, or None if it failed."""
+        content = self._read(listing_id)
+        if content is not None:
+            return content
+        future = self._submit(listing_id, url)
+        return future.result() if future is not None else None
+
+    def prefetch(self, listing_ids):
+        """Fetch the photos of some listings in the background."""
+        df = get_listing_store().df
+        for listing_id in listing_ids:
+            if listing_id in self._entries or listing_id not in df.index:
+                continue
+            self._submit(listing_id, df.at[listing_id, "Photo"])
+
+    def __str__(self):
+        return (f"{len(self._entries)} photos, {self.total_bytes / 1024 ** 2:.1f} MB, "
+                f"{self.hits} hits / {self.misses} misses")
+
+
+_photo_cache = None
+_photo_cache_lock = threading.Lock()
+
+
+def get_photo_cache():
+    """Return the process-wide photo cache."""
+    global _photo_cache
+    if _photo_cache is None:
+        with _photo_cache_lock:
+            if _photo_cache is None:
+                _photo_cache = PhotoCache()
+    return _photo_cache
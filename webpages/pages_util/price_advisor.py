@@ -1,102 +1,353 @@
+import asyncio
+import os
+import re
+import shutil
+import hashlib
+import threading
 import warnings
-import umap.umap_ as umap  # pip install umap-learn
+from abc import ABC, abstractmethod
+from collections import defaultdict
+import joblib
+import numpy as np
 import pandas as pd
-from sklearn.neighbors import NearestNeighbors
-from typing import Optional, Type
+from typing import List, Optional, Type, Union
 from langchain.callbacks.manager import (
     AsyncCallbackManagerForToolRun,
     CallbackManagerForToolRun,
 )
 from langchain.pydantic_v1 import BaseModel, Field
 from langchain.tools import BaseTool
-from webpages.pages_util.util import DATASET_PATH
+from webpages.pages_util.appraisal_pool import appraisal_pool, PoolSaturatedError, WARMUP_CAR
+from webpages.pages_util.listing_store import get_listing_store
+from webpages.pages_util.util import APPRAISAL_MODELS_DIR, dataset_version
 
 # Ignore warnings
 warnings.filterwarnings("ignore")
 
+# Select the useful columns to predict the similar price of the car
+NUMERIC_COLUMNS = ["Year", "Kilometers", "Displacement_cm3", "Power_hp"]
+CATEGORICAL_COLUMNS = ["Gear_Type", "Condition", "Fuel", "Compared_Price"]
+PREDICT_COLUMNS = NUMERIC_COLUMNS + CATEGORICAL_COLUMNS
+N_NEIGHBORS = 5
 
-def predict_price(brand: str,
-                  model: str,
-                  year: int,
-                  displacement_cm3: int,
-                  power_hp: int,
-                  gear_type: str,
-                  kilometers: int,
-                  fuel: str,
-                  condition: str = "used",
-                  ):
-    try:
-        df = pd.read_csv(DATASET_PATH, index_col=0)
+DEFAULT_APPRAISAL_MODE = "umap"
 
-        # Fixed values - Forces the model to look for cars with an average price
-        compared_price = "The price is within the average."
+# Fixed values - Forces the model to look for cars with an average price
+COMPARED_PRICE = "The price is within the average."
 
-        # Convert all str variables to lowercase
-        brand = brand.lower()
-        model = model.lower()
-        gear_type = gear_type.lower()
-        condition = condition.lower()
-        fuel = fuel.lower()
+APPRAISAL_BUSY = "Our appraisal service is busy right now. Please try again in a moment."
+NOT_ENOUGH_DATA = "We don't have enough data to make a prediction. Sorry for any inconvenience."
+MISSING_BRAND_MODEL = "We need the brand and model of the car to make a prediction."
 
-        # Convert the brand and model to lowercase
-        df["Brand"] = df["Brand"].str.lower()
-        df["Model"] = df["Model"].str.lower()
 
-        # Filter the df by brand and model
-        filtered_df = df[(df["Brand"] == brand) & (df["Model"] == model)]
+def to_feature_frame(cars):
+    """Rename the predictor inputs of the given cars to the dataset column names."""
+    return pd.DataFrame({"Year": cars["year"], "Kilometers": cars["kilometers"],
+                         "Displacement_cm3": cars["displacement_cm3"], "Power_hp": cars["power_hp"],
+                         "Gear_Type": cars["gear_type"], "Condition": cars["condition"], "Fuel": cars["fuel"],
+                         "Compared_Price": COMPARED_PRICE}, index=cars.index)
 
-        # Select the useful columns to predict the similar price of the car
-        predict_columns = ["Year", "Kilometers", "Displacement_cm3", "Power_hp", "Gear_Type", "Condition", "Fuel",
-                           "Compared_Price"]
 
-        # Use the columns to create a umap of the cars
-        df_umap = filtered_df[predict_columns]
+def encode_features(cars, categorical_columns=CATEGORICAL_COLUMNS, drop_first=False):
+    """One-hot encode the predictor columns of the given cars."""
+    features = cars[NUMERIC_COLUMNS + categorical_columns].copy()
+    features['Displacement_cm3'] = features['Displacement_cm3'].fillna(0)
 
-        df_umap['Displacement_cm3'] = df_umap['Displacement_cm3'].fillna(0)
+    # Convert the gear type, condition and fuel to lowercase
+    for column in ["Gear_Type", "Condition", "Fuel"]:
+        if column in categorical_columns:
+            features[column] = features[column].astype(str).str.lower()
 
-        # Add the new car to the df
-        df_umap.loc[1000000] = [year, kilometers, displacement_cm3, power_hp, gear_type, condition, fuel, compared_price]
+    # Convert the categorical columns to numerical
+    return pd.get_dummies(features, columns=categorical_columns, drop_first=drop_first)
 
-        # Convert the gear type and condition to lowercase
-        df_umap["Gear_Type"] = df_umap["Gear_Type"].str.lower()
-        df_umap["Condition"] = df_umap["Condition"].str.lower()
-        df_umap["Fuel"] = df_umap["Fuel"].str.lower()
 
-        # Convert the categorical columns to numerical
-        df_umap = pd.get_dummies(df_umap, columns=["Gear_Type", "Fuel", "Condition", "Compared_Price"],
-                                 drop_first=True)
+class AppraisalModel(ABC):
+    """Neighbour index fitted once on the listings of a single brand/model."""
 
-        # Create the umap
-        reducer = umap.UMAP(n_jobs=-1)
-        embedding = reducer.fit_transform(df_umap)
+    algorithm = 'ball_tree'
+
+    def __init__(self, brand, model, listings):
+        self.brand = brand
+        self.model = model
 
-        # Get the umap embedding of the new car
-        new_car_embedding = embedding[-1]
+        # Rows with missing numeric features would break the whole group, so they are left out
+        listings = listings.dropna(subset=["Year", "Kilometers", "Power_hp", "Price_EUR"])
 
+        # sklearn (and umap below) take seconds to import, they are only loaded when a model is fitted or unpickled
+        from sklearn.neighbors import NearestNeighbors
 
         # Fit the NearestNeighbors model
-        model_knn = NearestNeighbors(n_neighbors=6,
-                                     algorithm='ball_tree')  # n_neighbors is 6 because the car itself is included
-        model_knn.fit(embedding)
+        self.knn = NearestNeighbors(n_neighbors=N_NEIGHBORS, algorithm=self.algorithm)
+        self.knn.fit(self.fit_transform(listings))
+
+        self.listing_ids = listings.index.to_numpy()
+        self.prices = listings["Price_EUR"].to_numpy(dtype=float)
+
+    @abstractmethod
+    def fit_transform(self, listings):
+        """Fit the feature transformation on the listings and return their features."""
+
+    @abstractmethod
+    def transform(self, cars):
+        """Return the features of new cars, in the space fitted by fit_transform."""
+
+    def kneighbors(self, cars, n_neighbors=N_NEIGHBORS):
+        """Return the distances, listing ids and prices of the closest listings for each car."""
+        distances, indices = self.knn.kneighbors(self.transform(cars), n_neighbors=n_neighbors)
+        return distances, self.listing_ids[indices], self.prices[indices]
+
+
+class UmapAppraisalModel(AppraisalModel):
+    """Neighbours searched in a UMAP embedding of the one-hot encoded features."""
+
+    mode = "umap"
+
+    def fit_transform(self, listings):
+        import umap.umap_ as umap  # pip install umap-learn
+
+        features = encode_features(listings, drop_first=True)
+        self.columns = list(features.columns)
+
+        # Create the umap
+        self.reducer = umap.UMAP(n_jobs=-1)
+        embedding = self.reducer.fit_transform(features.astype(float))
+
+        # umap re-compiles its layout optimizer on every transform call, so new cars are placed at the
+        # weighted average of their neighbours in the fitted embedding (umap's own transform initialisation)
+        self.reducer.transform_mode = "graph"
+        return embedding
+
+    def transform(self, cars):
+        """Project new cars into the fitted umap space."""
+        import umap.umap_ as umap
+
+        features = encode_features(cars).reindex(columns=self.columns, fill_value=0)
+        graph = self.reducer.transform(features.astype(float))
+        return umap.init_graph_transform(graph.tocsr(), self.reducer.embedding_)
+
+
+class ScaledKnnAppraisalModel(AppraisalModel):
+    """Exact neighbours on standardized numeric features plus the encoded gear type, fuel and condition."""
+
+    mode = "scaled_knn"
+    algorithm = 'kd_tree'
+    categorical_columns = ["Gear_Type", "Condition", "Fuel"]
+
+    def fit_transform(self, listings):
+        features = encode_features(listings, self.categorical_columns)
+        self.columns = list(features.columns)
+
+        from sklearn.preprocessing import StandardScaler
+
+        self.scaler = StandardScaler()
+        features[NUMERIC_COLUMNS] = self.scaler.fit_transform(features[NUMERIC_COLUMNS].astype(float))
+        return features.to_numpy(dtype=float)
+
+    def transform(self, cars):
+        """Scale new cars with the statistics of the fitted listings."""
+        features = encode_features(cars, self.categorical_columns).reindex(columns=self.columns, fill_value=0)
+        features[NUMERIC_COLUMNS] = self.scaler.transform(features[NUMERIC_COLUMNS].astype(float))
+        return features.to_numpy(dtype=float)
+
+
+APPRAISAL_MODES = {model_class.mode: model_class for model_class in [UmapAppraisalModel, ScaledKnnAppraisalModel]}
+
+
+def _check_mode(mode):
+    if mode not in APPRAISAL_MODES:
+        raise ValueError(f"Unknown appraisal mode {mode!r}, expected one of {list(APPRAISAL_MODES)}")
+
+
+_models = {}
+_fit_locks = defaultdict(threading.Lock)
+
+
+def _model_path(version, mode, brand, model):
+    name = re.sub(r'[^a-z0-9]+', '-', f"{mode} {brand} {model}").strip('-')
+    digest = hashlib.md5(f"{mode}|{brand}|{model}".encode()).hexdigest()[:8]
+    return os.path.join(APPRAISAL_MODELS_DIR, version, f"{name}-{digest}.joblib")
+
+
+def _prune_stale_models(version):
+    """Remove the models fitted on previous versions of the dataset."""
+    if not os.path.isdir(APPRAISAL_MODELS_DIR):
+        return
+    for entry in os.listdir(APPRAISAL_MODELS_DIR):
+        if entry != version:
+            shutil.rmtree(os.path.join(APPRAISAL_MODELS_DIR, entry), ignore_errors=True)
+
+
+def get_appraisal_model(brand: str, model: str, mode: str = DEFAULT_APPRAISAL_MODE):
+    """Return the appraisal model of a brand/model, loading it from disk or fitting it if needed."""
+    _check_mode(mode)
+
+    brand, model = brand.lower(), model.lower()
+    store = get_listing_store()
+    version = store.version
+    key = (version, mode, brand, model)
+
+    if key in _models:
+        return _models[key]
+
+    with _fit_locks[key]:
+        if key in _models:
+            return _models[key]
+
+        path = _model_path(version, mode, brand, model)
+        if os.path.exists(path):
+            appraisal_model = joblib.load(path)
+        else:
+            # Filter the df by brand and model
+            filtered_df = store.select_brand_model(brand, model)
+            if filtered_df.empty:
+                raise ValueError(f"No listings for {brand} {model}")
 
-        # Find the nearest neighbors
-        distances, indices = model_knn.kneighbors([new_car_embedding])
+            appraisal_model = APPRAISAL_MODES[mode](brand, model, filtered_df)
 
-        # The first index will be the new car itself, so we exclude it
-        closest_neighbors_indices = indices[0][1:]
+            _prune_stale_models(version)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
 
-        # Get the indices in the original df
-        closest_neighbors_indeces_original_df = df_umap.iloc[closest_neighbors_indices].index
+            # Write to a temporary file first so other processes never load a half-written model
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            joblib.dump(appraisal_model, tmp_path)
+            os.replace(tmp_path, path)
 
-        # Extract the prices of the closest neighbors
-        avg_price = sum(df.iloc[closest_neighbors_indeces_original_df]["Price_EUR"].values) / 5
+        # Drop models of previous dataset versions kept in memory
+        for stale_key in [k for k in _models if k[0] != version]:
+            del _models[stale_key]
+        _models[key] = appraisal_model
 
-        # keep only the first 2 significant digits
-        avg_price = int(round(avg_price, -3))
+    return appraisal_model
+
+
+def preload_appraisal_models():
+    """Load every model saved for the current dataset version into memory and return them."""
+    version = dataset_version()
+    models_dir = os.path.join(APPRAISAL_MODELS_DIR, version)
+    if not os.path.isdir(models_dir):
+        return []
+
+    loaded = []
+    for file_name in os.listdir(models_dir):
+        if not file_name.endswith(".joblib"):
+            continue
+        appraisal_model = joblib.load(os.path.join(models_dir, file_name))
+        _models[(version, appraisal_model.mode, appraisal_model.brand, appraisal_model.model)] = appraisal_model
+        loaded.append(appraisal_model)
+    return loaded
+
+
+def warm_up_appraisal(n_listings=200):
+    """
+    Fit and query a throwaway model of each appraisal mode on synthetic listings, so the umap and sklearn code paths
+    are imported and their numba functions compiled (or read from the numba cache) before the first appraisal.
+    """
+    rng = np.random.default_rng(0)
+    listings = pd.DataFrame({"Year": rng.integers(2005, 2024, n_listings),
+                             "Kilometers": rng.integers(0, 300000, n_listings),
+                             "Displacement_cm3": rng.choice([1000, 1200, 1600, 2000, 3000], n_listings),
+                             "Power_hp": rng.integers(60, 300, n_listings),
+                             "Gear_Type": rng.choice(["Manual", "Automatic"], n_listings),
+                             "Condition": rng.choice(["Used", "New"], n_listings),
+                             "Fuel": rng.choice(["Diesel", "Gasoline", "Electric"], n_listings),
+                             "Compared_Price": rng.choice([COMPARED_PRICE, "Below average"], n_listings),
+                             "Price_EUR": rng.integers(2000, 80000, n_listings)})
+    car = to_feature_frame(pd.DataFrame([WARMUP_CAR]))
+    for model_class in APPRAISAL_MODES.values():
+        model_class("warm-up", "warm-up", listings).kneighbors(car)
+
+
+def estimate_price(brand: str,
+                   model: str,
+                   year: int,
+                   displacement_cm3: int,
+                   power_hp: int,
+                   gear_type: str,
+                   kilometers: int,
+                   fuel: str,
+                   condition: str = "used",
+                   mode: str = DEFAULT_APPRAISAL_MODE,
+                   ) -> int:
+    """Return the average price of the closest listings, raising if the car cannot be appraised."""
+    _check_mode(mode)
+    appraisal_model = get_appraisal_model(brand, model, mode)
+
+    new_car = to_feature_frame(pd.DataFrame([{"year": year, "kilometers": kilometers,
+                                              "displacement_cm3": displacement_cm3, "power_hp": power_hp,
+                                              "gear_type": gear_type, "condition": condition, "fuel": fuel}]))
+
+    # Find the nearest neighbors and extract their prices
+    distances, listing_ids, prices = appraisal_model.kneighbors(new_car)
+    avg_price = prices[0].mean()
+
+    # keep only the first 2 significant digits
+    return int(round(avg_price, -3))
+
+
+def predict_price(brand: str,
+                  model: str,
+                  year: int,
+                  displacement_cm3: int,
+                  power_hp: int,
+                  gear_type: str,
+                  kilometers: int,
+                  fuel: str,
+                  condition: str = "used",
+                  mode: str = DEFAULT_APPRAISAL_MODE,
+                  ):
+    _check_mode(mode)
+    try:
+        avg_price = estimate_price(brand=brand, model=model, year=year, displacement_cm3=displacement_cm3,
+                                   power_hp=power_hp, gear_type=gear_type, kilometers=kilometers, fuel=fuel,
+                                   condition=condition, mode=mode)
         return f'A car with those specifications is worth around {avg_price}€. Let me know if you need anything else. 😉'
 
     except Exception as e:
-        return "We don't have enough data to make a prediction. Sorry for any inconvenience."
+        return NOT_ENOUGH_DATA
+
+
+def predict_prices(cars: Union[pd.DataFrame, List["PredictorInput"]], mode: str = DEFAULT_APPRAISAL_MODE) -> pd.DataFrame:
+    """
+    Appraise many cars in one call.
+
+    Accepts a DataFrame with the PredictorInput fields as columns or a list of PredictorInput records. Cars are
+    grouped by brand/model so each group shares its fitted model and runs a single neighbour query.
+    Returns one row per car (same index as the input) with the price, the neighbour listing ids, their distances
+    and an error message for the cars that could not be appraised.
+    """
+    _check_mode(mode)
+    if not isinstance(cars, pd.DataFrame):
+        cars = pd.DataFrame([car.dict() for car in cars])
+
+    cars = cars.copy()
+    if "condition" not in cars:
+        cars["condition"] = "used"
+    cars["condition"] = cars["condition"].fillna("used")
+
+    results = pd.DataFrame(index=cars.index, columns=["price", "neighbour_ids", "distances", "error"], dtype=object)
+
+    # Keep the cars without a brand or model as their own group, so they get an error instead of being dropped
+    groups = cars.groupby([cars["brand"].str.lower(), cars["model"].str.lower()], sort=False, dropna=False)
+    for (brand, model), group in groups:
+        if pd.isna(brand) or pd.isna(model):
+            results.loc[group.index, "error"] = MISSING_BRAND_MODEL
+            continue
+
+        try:
+            appraisal_model = get_appraisal_model(brand, model, mode)
+            distances, listing_ids, prices = appraisal_model.kneighbors(to_feature_frame(group))
+        except Exception as e:
+            results.loc[group.index, "error"] = NOT_ENOUGH_DATA
+            continue
+
+        avg_prices = prices.mean(axis=1).round(-3).astype(int)
+        for row, index in enumerate(group.index):
+            results.at[index, "price"] = int(avg_prices[row])
+            results.at[index, "neighbour_ids"] = listing_ids[row].tolist()
+            results.at[index, "distances"] = distances[row].tolist()
+
+    return results
 
 
 class PredictorInput(BaseModel):
@@ -140,4 +391,55 @@ class CustomPredictorTool(BaseTool):
             run_manager: Optional[AsyncCallbackManagerForToolRun] = None,
     ) -> str:
         """Use the tool asynchronously."""
-        raise NotImplementedError("Predictor does not support async")
+        try:
+            return str(await appraisal_pool.run(predict_price,
+                                                brand=brand,
+                                                model=model,
+                                                year=year,
+                                                displacement_cm3=displacement_cm3,
+                                                power_hp=power_hp,
+                                                gear_type=gear_type,
+                                                kilometers=kilometers,
+                                                fuel=fuel,
+                                                condition=condition,
+                                                ))
+        except (PoolSaturatedError, asyncio.TimeoutError):
+            return APPRAISAL_BUSY
+
+
+class BatchPredictorInput(BaseModel):
+    cars: List[PredictorInput] = Field(description="list of cars to appraise")
+
+
+def batch_appraisal_message(cars: List[dict]):
+    """Appraise several cars and present the prices as a markdown table."""
+    cars = pd.DataFrame([dict(car) for car in cars])
+    results = predict_prices(cars)
+
+    table = cars[["brand", "model", "year", "kilometers"]].copy()
+    table["price (€)"] = results["price"].where(results["error"].isna(), "n/a")
+    return f"Here are the appraisals for your cars:\n\n{table.to_markdown()}"
+
+
+class CustomBatchPredictorTool(BaseTool):
+    name = "batch_price_predictor"
+    description = "useful for when you need to predict the prices of several cars at once"
+    args_schema: Type[BaseModel] = BatchPredictorInput
+    return_direct: bool = True
+
+    def _run(
+            self, cars: List[dict],
+            run_manager: Optional[CallbackManagerForToolRun] = None
+    ) -> str:
+        """Use the tool."""
+        return batch_appraisal_message(cars)
+
+    async def _arun(
+            self, cars: List[dict],
+            run_manager: Optional[AsyncCallbackManagerForToolRun] = None,
+    ) -> str:
+        """Use the tool asynchronously."""
+        try:
+            return await appraisal_pool.run(batch_appraisal_message, [dict(car) for car in cars])
+        except (PoolSaturatedError, asyncio.TimeoutError):
+            return APPRAISAL_BUSY
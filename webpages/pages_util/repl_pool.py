@@ -0,0 +1,322 @@
+import asyncio
+import multiprocessing
+import os
+import queue
+import signal
+import threading
+from typing import Optional, Type
+from langchain.callbacks.manager import (
+    AsyncCallbackManagerForToolRun,
+    CallbackManagerForToolRun,
+)
+from langchain.pydantic_v1 import BaseModel, Field
+from langchain.tools import BaseTool
+from webpages.pages_util.appraisal_pool import PoolSaturatedError
+
+try:
+    import resource
+except ImportError:  # Windows, the code still runs in the workers but without CPU and memory limits
+    resource = None
+
+REPL_WORKERS = 2
+# Queries allowed to wait for a free worker before new ones are rejected
+REPL_MAX_PENDING = 8
+# Wall-clock seconds before a worker is killed and replaced, and CPU seconds a single query may use
+REPL_TIMEOUT = 15
+REPL_CPU_SECONDS = 10
+# Memory a worker may allocate on top of what it holds after loading the listings
+REPL_MEMORY_MB = 1024
+REPL_MAX_OUTPUT_CHARS = 5000
+# Keep the printed DataFrames short, their text is sent to the model
+DISPLAY_MAX_ROWS = 20
+DISPLAY_MAX_COLUMNS = 21
+# Seconds between two checks of a closed pool by the queries waiting for a worker
+ACQUIRE_POLL_SECONDS = 0.5
+
+REPL_BUSY = "Error: the Python tool is busy right now, answer without it or try again in a moment."
+REPL_TIMED_OUT = "TimeoutError: the code took longer than {seconds} s and was stopped. Use a faster query on df."
+
+
+class CpuTimeExceeded(BaseException):
+    # Not an Exception, the REPL tool would return it as the query's output instead of letting the worker see it
+    pass
+
+
+def _on_cpu_limit(signum, frame):
+    raise CpuTimeExceeded("the code used up its CPU time and was stopped. Use a faster query on df.")
+
+
+def _limit_memory(memory_mb):
+    """Cap the address space of the worker to its current size plus memory_mb."""
+    try:
+        with open("/proc/self/statm") as f:
+            current = int(f.read().split()[0]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        return
+    limit = current + memory_mb * 1024 ** 2
+    resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+
+def _limit_cpu(seconds=None):
+    """Let the worker use `seconds` more CPU seconds, or lift the limit when seconds is None."""
+    _, hard = resource.getrlimit(resource.RLIMIT_CPU)
+    if seconds is None:
+        resource.setrlimit(resource.RLIMIT_CPU, (hard, hard))
+        return
+    # RLIMIT_CPU counts the whole life of the process, the soft limit is moved past the CPU time already used
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    soft = int(usage.ru_utime + usage.ru_stime) + seconds
+    resource.setrlimit(resource.RLIMIT_CPU, (soft if hard == resource.RLIM_INFINITY else min(soft, hard), hard))
+
+
+def _truncate(output, max_chars):
+    if len(output) <= max_chars:
+        return output
+    return f"{output[:max_chars]}\n... (output truncated, {len(output)} characters in total)"
+
+
+def _worker_main(conn, cpu_seconds, memory_mb, max_output_chars):
+    """
+    Worker loop: run each query received on conn in a fresh namespace holding a read-only view of the listings, and
+    send back its output with whether the worker must be replaced (it ran out of CPU time or memory).
+    """
+    import pandas as pd
+    from langchain_experimental.tools import PythonAstREPLTool
+    from webpages.pages_util.listing_store import get_listing_store
+
+    pd.set_option("display.max_rows", DISPLAY_MAX_ROWS)
+    pd.set_option("display.max_columns", DISPLAY_MAX_COLUMNS)
+
+    store = get_listing_store()
+    if resource is not None:
+        _limit_memory(memory_mb)
+        signal.signal(signal.SIGXCPU, _on_cpu_limit)
+
+    while True:
+        try:
+            query = conn.recv()
+        except EOFError:
+            return
+        if query is None:
+            return
+
+        if resource is not None:
+            _limit_cpu(cpu_seconds)
+        try:
+            # The workers serve every session, nothing a query defines is left for the next one
+            output = str(PythonAstREPLTool(locals={"df": store.view()})._run(query))
+            # The tool returns the exceptions of the code as its output
+            broken = output.startswith("MemoryError:")
+        except (CpuTimeExceeded, MemoryError) as e:
+            output = f"{type(e).__name__}: {e}"
+            broken = True
+        finally:
+            if resource is not None:
+                _limit_cpu()
+        conn.send((_truncate(output, max_output_chars), broken))
+        if broken:
+            return
+
+
+class ReplWorker:
+    """A worker process holding the listings, fed with queries through a pipe."""
+
+    def __init__(self, context, cpu_seconds, memory_mb, max_output_chars, generation=0):
+        # Pool generation the worker was started in, workers of a pool shut down since are closed on release
+        self.generation = generation
+        self.conn, child_conn = context.Pipe()
+        # Started right away, a worker spawned to replace a killed one boots while the others serve the queries
+        self.process = context.Process(target=_worker_main, name="repl-worker", daemon=True,
+                                       args=(child_conn, cpu_seconds, memory_mb, max_output_chars))
+        self.process.start()
+        child_conn.close()
+
+    def run(self, query, timeout):
+        """
+        Send a query and wait for its output and whether the worker is broken, raise TimeoutError when none came within
+        the timeout.
+        """
+        self.conn.send(query)
+        if not self.conn.poll(timeout):
+            raise TimeoutError
+        return self.conn.recv()
+
+    def kill(self):
+        self.process.kill()
+        self.process.join()
+        self.conn.close()
+
+    def close(self):
+        try:
+            self.conn.send(None)
+        except OSError:
+            pass
+        self.process.join(timeout=1)
+        if self.process.is_alive():
+            self.process.kill()
+        self.conn.close()
+
+
+class ReplPool:
+    """
+    Pool of sandboxed worker processes running the agent's pandas code, so a slow or memory hungry query only holds
+    its own worker. A worker that times out or dies is killed and replaced in the background.
+    """
+
+    def __init__(self, workers=REPL_WORKERS, max_pending=REPL_MAX_PENDING, timeout=REPL_TIMEOUT,
+                 cpu_seconds=REPL_CPU_SECONDS, memory_mb=REPL_MEMORY_MB, max_output_chars=REPL_MAX_OUTPUT_CHARS):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self.cpu_seconds = cpu_seconds
+        self.memory_mb = memory_mb
+        self.max_output_chars = max_output_chars
+        self.in_flight = 0
+        self.completed = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.replaced = 0
+        self._context = multiprocessing.get_context("spawn")
+        self._idle = queue.Queue()
+        self._started = False
+        self._closed = False
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def _spawn(self, generation):
+        return ReplWorker(self._context, self.cpu_seconds, self.memory_mb, self.max_output_chars, generation)
+
+    def start(self):
+        """Spawn the workers ahead of the first query, or again after a shutdown."""
+        with self._lock:
+            if not self._started or self._closed:
+                self._started, self._closed = True, False
+                for _ in range(self.workers):
+                    self._idle.put(self._spawn(self._generation))
+        return self
+
+    def _acquire(self):
+        while True:
+            if self._closed:
+                raise PoolSaturatedError("the Python workers are shut down")
+            try:
+                return self._idle.get(timeout=ACQUIRE_POLL_SECONDS)
+            except queue.Empty:
+                pass
+
+    def _release(self, worker):
+        """Hand a worker back to the queries, or close it if the pool was shut down since it started."""
+        with self._lock:
+            if not self._closed and worker.generation == self._generation:
+                self._idle.put(worker)
+                return
+        worker.close()
+
+    def run(self, query):
+        """Run a query in a free worker and return its output, or an error message for the agent."""
+        self.start()
+        with self._lock:
+            if self.in_flight >= self.workers + self.max_pending:
+                self.rejected += 1
+                raise PoolSaturatedError(f"{self.in_flight} queries already running or queued")
+            self.in_flight += 1
+
+        try:
+            worker = self._acquire()
+        except PoolSaturatedError:
+            with self._lock:
+                self.in_flight -= 1
+            raise
+
+        broken = False
+        try:
+            output, broken = worker.run(query, self.timeout)
+        except TimeoutError:
+            output = REPL_TIMED_OUT.format(seconds=self.timeout)
+            with self._lock:
+                self.timed_out += 1
+            broken = True
+        except (EOFError, OSError):
+            # The worker died, e.g. killed by the CPU hard limit or the out-of-memory killer
+            output = "Error: the code crashed the Python tool. Use a lighter query on df."
+            broken = True
+        finally:
+            if broken:
+                self._replace(worker)
+            else:
+                self._release(worker)
+            with self._lock:
+                self.in_flight -= 1
+                self.completed += 1
+        return output
+
+    def _replace(self, worker):
+        # Killing the worker and spawning the next one happen in the background, off the query's path
+        with self._lock:
+            self.replaced += 1
+        threading.Thread(target=self._respawn, args=(worker,), name="repl-respawn", daemon=True).start()
+
+    def _respawn(self, worker):
+        worker.kill()
+        with self._lock:
+            if self._closed or worker.generation != self._generation:
+                return
+        self._release(self._spawn(worker.generation))
+
+    def stats(self):
+        """Pool saturation metrics: busy workers, queued queries and the counters since start."""
+        with self._lock:
+            busy = min(self.in_flight, self.workers)
+            return {"workers": self.workers,
+                    "busy_workers": busy,
+                    "queued": self.in_flight - busy,
+                    "completed": self.completed,
+                    "rejected": self.rejected,
+                    "timed_out": self.timed_out,
+                    "replaced": self.replaced}
+
+    def shutdown(self):
+        """Close the idle workers, the busy ones are closed when their query is done."""
+        with self._lock:
+            self._closed = True
+            self._generation += 1
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+    def __str__(self):
+        stats = self.stats()
+        return f"{stats['busy_workers']}/{stats['workers']} busy, {stats['timed_out']} timed out"
+
+
+repl_pool = ReplPool()
+
+
+class PythonInputs(BaseModel):
+    query: str = Field(description="code snippet to run")
+
+
+class SandboxedPythonTool(BaseTool):
+    name = "python_repl"
+    description = "Runs code and returns the output of the final line"
+    args_schema: Type[BaseModel] = PythonInputs
+
+    def _run(
+            self, query: str,
+            run_manager: Optional[CallbackManagerForToolRun] = None
+    ) -> str:
+        """Use the tool."""
+        try:
+            return repl_pool.run(query)
+        except PoolSaturatedError:
+            return REPL_BUSY
+
+    async def _arun(
+            self, query: str,
+            run_manager: Optional[AsyncCallbackManagerForToolRun] = None,
+    ) -> str:
+        """Use the tool asynchronously."""
+        # The pool blocks on a pipe, the wait happens on a thread so the event loop keeps serving the other turns
+        return await asyncio.get_running_loop().run_in_executor(None, self._run, query)
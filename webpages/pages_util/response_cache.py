@@ -0,0 +1,225 @@
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import warnings
+import numpy as np
+from typing import Any, Optional
+from langchain_core.caches import BaseCache, RETURN_VAL_TYPE
+from langchain_core.load import dumps, loads
+from webpages.pages_util.util import RESPONSE_CACHE_PATH, dataset_version
+
+RESPONSE_CACHE_ENABLED = os.environ.get("AUTOMENTOR_RESPONSE_CACHE", "1") == "1"
+# The semantic tier costs an embedding call per question that misses the exact tier
+SEMANTIC_CACHE_ENABLED = os.environ.get("AUTOMENTOR_SEMANTIC_CACHE", "0") == "1"
+RESPONSE_CACHE_TTL = 24 * 60 * 60
+RESPONSE_CACHE_MAX_ENTRIES = 5000
+# Cosine similarity above which two questions asked in the same context get the same answer
+SEMANTIC_THRESHOLD = 0.97
+# A missed call not stored by then has failed, its pending entry is dropped
+PENDING_TTL = 60
+NUMBER_PATTERN = re.compile(r"\d+(?:[.,]\d+)*")
+
+
+def normalize_prompt(prompt: str):
+    """Case and whitespace insensitive version of a serialized prompt."""
+    return " ".join(prompt.lower().split())
+
+
+def _hash(*parts):
+    return hashlib.sha256("\x00".join(parts).encode()).hexdigest()
+
+
+def split_last_question(prompt: str):
+    """
+    Split a serialized list of messages into the context (all but the last message) and the last user question.
+
+    Returns (None, None) unless the last message is a HumanMessage, the later calls of an agent run depend on the
+    tool outputs and only get exact hits.
+    """
+    try:
+        messages = json.loads(prompt)
+        last = messages[-1]
+        if last["id"][-1] != "HumanMessage":
+            return None, None
+        return json.dumps(messages[:-1], sort_keys=True), last["kwargs"]["content"]
+    except (ValueError, KeyError, IndexError, TypeError):
+        return None, None
+
+
+class ResponseCache(BaseCache):
+    """
+    Persistent LLM response cache, used by every chat model of the process through langchain's set_llm_cache.
+
+    Exact tier: responses keyed by the normalized prompt (system prompt, memory, question and scratchpad) and the
+    llm string, which includes the model parameters and the tool schemas.
+    Semantic tier (when embeddings are given): a question whose embedding is close enough to one already answered
+    in the same context, with the same numbers in it, gets that answer. The cache is shared by sessions using
+    different API keys, so it never calls the embedding model itself: it reads the question's embedding from the
+    cache of the CachedEmbeddings, where the session put it with its own key before the model call.
+
+    Entries expire after `ttl` seconds, the least recently used ones are evicted past `max_entries`, and the whole
+    cache is dropped when the dataset version changes since the answers refer to listings.
+    """
+
+    def __init__(self, path=RESPONSE_CACHE_PATH, ttl=RESPONSE_CACHE_TTL, max_entries=RESPONSE_CACHE_MAX_ENTRIES,
+                 embeddings=None, threshold=SEMANTIC_THRESHOLD):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.embeddings = embeddings
+        self.threshold = threshold
+
+        self._lock = threading.Lock()
+        # (prompt, llm_string) -> (lookup time, question embedding) of the calls that missed the cache, in lookup order
+        self._pending = {}
+        self.version = None
+        self.exact_hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        self.time_saved = 0.0
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, version TEXT, llm_hash TEXT, "
+            "context_hash TEXT, question TEXT, embedding BLOB, response TEXT, duration REAL, created REAL, "
+            "last_used REAL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS responses_context ON responses (llm_hash, context_hash)")
+
+    def _check_version(self):
+        version = dataset_version()
+        if version != self.version:
+            with self._lock:
+                self._db.execute("DELETE FROM responses WHERE version != ?", (version,))
+                self.version = version
+
+    def _hit(self, key, response, duration, semantic=False):
+        with self._lock:
+            self._db.execute("UPDATE responses SET last_used = ? WHERE key = ?", (time.time(), key))
+            if semantic:
+                self.semantic_hits += 1
+            else:
+                self.exact_hits += 1
+            self.time_saved += duration
+        with warnings.catch_warnings():
+            # loads() warns that it is in beta on every call
+            warnings.simplefilter("ignore")
+            return [loads(generation) for generation in json.loads(response)]
+
+    def _semantic_lookup(self, llm_hash, context_hash, question, embedding):
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT key, question, embedding, response, duration FROM responses "
+                "WHERE llm_hash = ? AND context_hash = ? AND created > ? AND embedding IS NOT NULL",
+                (llm_hash, context_hash, time.time() - self.ttl),
+            ).fetchall()
+        if not rows:
+            return None
+
+        stored = np.stack([np.frombuffer(row[2], dtype=np.float32) for row in rows])
+        similarities = stored @ embedding / (np.linalg.norm(stored, axis=1) * np.linalg.norm(embedding) + 1e-12)
+        best = int(np.argmax(similarities))
+        key, stored_question, _, response, duration = rows[best]
+        # "below 15000" and "below 20000" embed almost the same, the numbers must match too
+        if similarities[best] < self.threshold or \
+                NUMBER_PATTERN.findall(stored_question) != NUMBER_PATTERN.findall(question):
+            return None
+        return self._hit(key, response, duration, semantic=True)
+
+    def lookup(self, prompt: str, llm_string: str) -> Optional[RETURN_VAL_TYPE]:
+        """Look up based on prompt and llm_string."""
+        self._check_version()
+        start = time.perf_counter()
+        key = _hash(self.version, llm_string, normalize_prompt(prompt))
+        with self._lock:
+            row = self._db.execute("SELECT response, duration FROM responses WHERE key = ? AND created > ?",
+                                   (key, time.time() - self.ttl)).fetchone()
+        if row is not None:
+            return self._hit(key, *row)
+
+        embedding = None
+        if self.embeddings is not None:
+            context, question = split_last_question(prompt)
+            if question:
+                embedding = self.embeddings.cached_query(question)
+                if embedding is not None:
+                    embedding = np.asarray(embedding, dtype=np.float32)
+            if embedding is not None:
+                cached = self._semantic_lookup(_hash(llm_string), _hash(normalize_prompt(context)), question,
+                                               embedding)
+                if cached is not None:
+                    return cached
+
+        with self._lock:
+            self.misses += 1
+            # update() is never called when the model call fails
+            while self._pending and next(iter(self._pending.values()))[0] < start - PENDING_TTL:
+                del self._pending[next(iter(self._pending))]
+            self._pending.pop((prompt, llm_string), None)
+            self._pending[(prompt, llm_string)] = (start, embedding)
+        return None
+
+    def update(self, prompt: str, llm_string: str, return_val: RETURN_VAL_TYPE) -> None:
+        """Update cache based on prompt and llm_string."""
+        with self._lock:
+            start, embedding = self._pending.pop((prompt, llm_string), (time.perf_counter(), None))
+        duration = time.perf_counter() - start
+
+        context, question = split_last_question(prompt)
+        now = time.time()
+        row = (_hash(self.version, llm_string, normalize_prompt(prompt)), self.version, _hash(llm_string),
+               _hash(normalize_prompt(context)) if context is not None else None, question,
+               embedding.tobytes() if embedding is not None else None,
+               json.dumps([dumps(generation) for generation in return_val]), duration, now, now)
+
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", row)
+            self._db.execute("DELETE FROM responses WHERE created <= ?", (now - self.ttl,))
+            self._db.execute(
+                "DELETE FROM responses WHERE key IN (SELECT key FROM responses ORDER BY last_used DESC "
+                "LIMIT -1 OFFSET ?)", (self.max_entries,)
+            )
+
+    def clear(self, **kwargs: Any) -> None:
+        """Clear cache that can take additional keyword arguments."""
+        with self._lock:
+            self._db.execute("DELETE FROM responses")
+            self._pending.clear()
+
+    def stats(self):
+        lookups = self.exact_hits + self.semantic_hits + self.misses
+        return {
+            "exact_hits": self.exact_hits,
+            "semantic_hits": self.semantic_hits,
+            "misses": self.misses,
+            "hit_rate": (self.exact_hits + self.semantic_hits) / lookups if lookups else 0.0,
+            "time_saved": self.time_saved,
+        }
+
+    def __str__(self):
+        stats = self.stats()
+        return f"{stats['hit_rate']:.0%} hit rate, {stats['time_saved']:.1f}s saved"
+
+
+_response_cache = None
+_response_cache_lock = threading.Lock()
+
+
+def get_response_cache(embeddings=None):
+    """
+    Return the process-wide response cache.
+
+    embeddings: CachedEmbeddings enabling the semantic tier, only used when the cache is created.
+    """
+    global _response_cache
+    if _response_cache is None:
+        with _response_cache_lock:
+            if _response_cache is None:
+                _response_cache = ResponseCache(embeddings=embeddings)
+    return _response_cache
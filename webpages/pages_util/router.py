@@ -0,0 +1,151 @@
+import re
+import pandas as pd
+from webpages.pages_util.listing_store import get_listing_store
+
+# A number after a car/listing token: "details of listing #8342", "more info on car nº 8342", "show me a car 5 seats"...
+# Only the marker (number, nº, id, #) makes it a listing id anywhere in the question
+LISTING_ID_PATTERN = re.compile(r"\b(?:car|listing)\s*((?:number|n[ºo°]\.?|id)\s*#?|#)?\s*(\d+)\b", re.IGNORECASE)
+# Without a marker, the whole question must be a plain lookup ending with the id: "Please tell me more about car 8342."
+UNMARKED_ID_QUESTION = re.compile(
+    r"^\W*(?:please\s+)?(?:(?:can|could)\s+you\s+)?(?:please\s+)?"
+    r"(?:tell\s+me\s+more|(?:more\s+)?(?:info|information|details?)|(?:show\s+me\s+)?(?:the\s+)?(?:link|url))"
+    r"\s+(?:about|on|of|for|to)\s+(?:the\s+)?(?:car|listing)\s+(\d+)\W*$",
+    re.IGNORECASE,
+)
+# "the car 2019" is more likely a model year than a listing id, those are left to the agent unless marked as an id
+YEAR_LIKE_IDS = range(1900, 2100)
+DETAILS_WORDS = re.compile(r"\b(?:more|about|details?|info|information|describe|tell|show)\b", re.IGNORECASE)
+LINK_WORDS = re.compile(r"\b(?:link|url|website|standvirtual)\b", re.IGNORECASE)
+# Anything the agent has to reason about goes through the normal path
+AGENT_WORDS = re.compile(r"\b(?:appraise|appraisal|worth|value|price of my|compare|similar|cheaper|instead|than)\b",
+                         re.IGNORECASE)
+MAX_WORDS = 15
+
+
+def route_message(message: str):
+    """
+    Detect the simple intents that can be answered without the agent.
+
+    Returns (intent, listing_id) with intent "listing_details" or "listing_link", or None when the message needs
+    the agent.
+    """
+    if len(message.split()) > MAX_WORDS or AGENT_WORDS.search(message):
+        return None
+
+    matches = LISTING_ID_PATTERN.findall(message)
+    if any(not marker for marker, _ in matches):
+        unmarked = UNMARKED_ID_QUESTION.match(message)
+        if unmarked is None or int(unmarked.group(1)) in YEAR_LIKE_IDS:
+            return None
+    listing_ids = {int(number) for _, number in matches}
+    if len(listing_ids) != 1:
+        return None
+    listing_id = listing_ids.pop()
+
+    if listing_id not in get_listing_store().df.index:
+        return None
+
+    if LINK_WORDS.search(message):
+        return "listing_link", listing_id
+    if DETAILS_WORDS.search(message):
+        return "listing_details", listing_id
+    return None
+
+
+def _value(row, column):
+    value = row.get(column)
+    if value is None or (not isinstance(value, str) and pd.isna(value)):
+        return None
+    return value
+
+
+def render_listing_details(listing_id, row):
+    """Describe a listing in a few sentences, without any model call."""
+    car = {column: _value(row, column) for column in ["Brand", "Model", "Year", "Advertiser", "Power_hp",
+                                                       "Displacement_cm3", "Fuel", "Gear_Type", "Condition", "Color",
+                                                       "Kilometers", "Price_EUR", "Compared_Price", "Link"]}
+
+    description = f"Car #{listing_id} is a {car['Brand']} {car['Model']}"
+    if car["Year"]:
+        description += f" from {car['Year']}"
+    if car["Advertiser"]:
+        description += f", listed by a {str(car['Advertiser']).lower()} seller"
+    description += "."
+
+    engine = [f"{car['Power_hp']} hp" if car["Power_hp"] else None,
+              f"{car['Displacement_cm3']} cm3" if car["Displacement_cm3"] else None,
+              str(car["Fuel"]).lower() if car["Fuel"] else None]
+    engine = " ".join(part for part in engine if part)
+    if engine:
+        description += f" It has a {engine} engine"
+        if car["Gear_Type"]:
+            description += f" and {str(car['Gear_Type']).lower()} transmission"
+        description += "."
+
+    if car["Kilometers"] is not None:
+        condition = " ".join(str(car[column]).lower() for column in ["Condition", "Color"] if car[column])
+        description += f" This {condition} car has covered {int(car['Kilometers']):,} kilometers."
+    if car["Price_EUR"]:
+        description += f" It is priced at €{int(car['Price_EUR']):,}."
+    if car["Compared_Price"]:
+        description += f" {car['Compared_Price']}"
+    if car["Link"]:
+        description += f" Explore further at [Standvirtual]({car['Link']})."
+
+    return description
+
+
+def render_listing_link(listing_id, row):
+    if not _value(row, "Link"):
+        return f"Sorry, car #{listing_id} doesn't have a link available."
+    return f"Here is the link to car #{listing_id}: [Standvirtual]({_value(row, 'Link')})"
+
+
+def _find_listing(message: str):
+    """Route a message and fetch its listing: (intent, listing_id, row), or None if the agent is needed."""
+    route = route_message(message)
+    if route is None:
+        return None
+    intent, listing_id = route
+    return intent, listing_id, get_listing_store().df.loc[listing_id]
+
+
+def _render(intent, listing_id, row):
+    if intent == "listing_link":
+        return render_listing_link(listing_id, row)
+    return render_listing_details(listing_id, row)
+
+
+def answer_simple_intent(message: str, summarize=None):
+    """
+    Answer a simple intent straight from the listing store, or return None if the agent is needed.
+
+    summarize: optional callable (listing markdown -> text) used to word the listing details with a single model call
+    instead of the template.
+    """
+    listing = _find_listing(message)
+    if listing is None:
+        return None
+
+    intent, listing_id, row = listing
+    if intent == "listing_details" and summarize is not None:
+        try:
+            return summarize(row.to_markdown())
+        except Exception:
+            pass
+    return _render(intent, listing_id, row)
+
+
+async def aanswer_simple_intent(message: str, asummarize=None):
+    """Asynchronous answer_simple_intent, asummarize being a coroutine function so the model call is awaited."""
+    listing = _find_listing(message)
+    if listing is None:
+        return None
+
+    intent, listing_id, row = listing
+    if intent == "listing_details" and asummarize is not None:
+        try:
+            return await asummarize(row.to_markdown())
+        except Exception:
+            pass
+    return _render(intent, listing_id, row)
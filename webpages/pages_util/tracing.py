@@ -0,0 +1,174 @@
+import json
+import threading
+import time
+import uuid
+from collections import deque
+from typing import Any, Dict, List
+from langchain.callbacks.base import BaseCallbackHandler
+from webpages.pages_util.util import TRACE_PATH
+
+# Spans kept in memory per session for the sidebar
+MAX_RECENT_SPANS = 200
+
+_sink_lock = threading.Lock()
+_encoding = None
+
+
+def write_spans(spans, path=TRACE_PATH):
+    """Append spans to the JSONL trace file, an empty path disables the sink."""
+    if not path or not spans:
+        return
+    lines = "".join(json.dumps(span, default=str) + "\n" for span in spans)
+    with _sink_lock:
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(lines)
+
+
+def _size(value):
+    return len(value) if isinstance(value, str) else len(json.dumps(value, default=str))
+
+
+def count_tokens(text: str):
+    """Tokens of a text for the chat models (cl100k_base), tiktoken is only loaded by the first traced call."""
+    global _encoding
+    if _encoding is None:
+        import tiktoken
+        _encoding = tiktoken.get_encoding("cl100k_base")
+    return len(_encoding.encode(text))
+
+
+def _function_call(message):
+    function_call = (getattr(message, "additional_kwargs", None) or {}).get("function_call")
+    return json.dumps(function_call) if function_call else ""
+
+
+def count_prompt_tokens(messages, functions=None):
+    """Tokens of the messages and function schemas sent to a chat model, counted like benchmarks/prompt_tokens.py."""
+    # Every chat message costs its content plus a few formatting tokens
+    tokens = sum(4 + count_tokens(str(message.content)) + count_tokens(_function_call(message)) for message in messages)
+    return tokens + 3 + (count_tokens(json.dumps(functions)) if functions else 0)
+
+
+class TracingHandler(BaseCallbackHandler):
+    """
+    Record a span for every LLM, tool and retriever call of a session, plus one span per chat turn.
+
+    A span holds its type, name, duration, input/output sizes in characters and, for LLM calls, the token counts
+    and the time to the first token. Streamed calls return no API usage, their tokens are counted with tiktoken:
+    the prompt messages and function schemas, and the final text or function call arguments.
+    Spans are appended to the JSONL sink at the end of each turn.
+    """
+
+    # Called on the event loop of async runs instead of in executor threads, the spans are timed where they happen
+    run_inline = True
+
+    def __init__(self, session_id=None, path=TRACE_PATH):
+        self.session_id = session_id or uuid.uuid4().hex[:8]
+        self.path = path
+        self.turn = 0
+        self.recent = deque(maxlen=MAX_RECENT_SPANS)
+        self._lock = threading.Lock()
+        self._open = {}
+        self._turn_spans = []
+        self._turn_start = None
+
+    def _start(self, run_id, span_type, name, payload, **fields):
+        with self._lock:
+            self._open[run_id] = {"session": self.session_id, "turn": self.turn, "type": span_type, "name": name,
+                                  "start": time.time(), "input_chars": _size(payload), **fields,
+                                  "_started": time.perf_counter()}
+
+    def _end(self, run_id, output=None, error=None, **fields):
+        with self._lock:
+            span = self._open.pop(run_id, None)
+            if span is None:
+                return
+            span["duration_ms"] = (time.perf_counter() - span.pop("_started")) * 1000
+            span["output_chars"] = _size(output) if output is not None else 0
+            span.update(fields)
+            if error is not None:
+                span["error"] = repr(error)
+            self._turn_spans.append(span)
+            self.recent.append(span)
+
+    def start_turn(self, message: str):
+        with self._lock:
+            self.turn += 1
+            self._turn_spans = []
+            self._turn_start = (time.time(), time.perf_counter(), len(message))
+
+    def end_turn(self, output=None, error=None):
+        with self._lock:
+            if self._turn_start is None:
+                return
+            start, started, input_chars = self._turn_start
+            span = {"session": self.session_id, "turn": self.turn, "type": "turn", "name": "chat_turn",
+                    "start": start, "duration_ms": (time.perf_counter() - started) * 1000,
+                    "input_chars": input_chars, "output_chars": _size(output) if output is not None else 0}
+            if error is not None:
+                span["error"] = repr(error)
+            self._turn_spans.append(span)
+            self.recent.append(span)
+            spans, self._turn_spans, self._turn_start = self._turn_spans, [], None
+        write_spans(spans, self.path)
+
+    def last_turn(self):
+        """Spans of the latest turn, in the order they ended."""
+        with self._lock:
+            return [span for span in self.recent if span["turn"] == self.turn]
+
+    # LLM calls
+
+    def on_chat_model_start(self, serialized: Dict[str, Any], messages: List[List[Any]], *, run_id, **kwargs):
+        functions = (kwargs.get("invocation_params") or {}).get("functions")
+        self._start(run_id, "llm", serialized.get("kwargs", {}).get("model_name", "chat_model"),
+                    "".join(str(message.content) for batch in messages for message in batch),
+                    prompt_tokens=sum(count_prompt_tokens(batch, functions) for batch in messages))
+
+    def on_llm_start(self, serialized: Dict[str, Any], prompts: List[str], *, run_id, **kwargs):
+        self._start(run_id, "llm", serialized.get("id", ["llm"])[-1], "".join(prompts),
+                    prompt_tokens=sum(count_tokens(prompt) for prompt in prompts))
+
+    def on_llm_new_token(self, token: str, *, run_id, **kwargs):
+        span = self._open.get(run_id)
+        if span is not None and "first_token_ms" not in span:
+            span["first_token_ms"] = (time.perf_counter() - span["_started"]) * 1000
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        generation = response.generations[0][0] if response.generations and response.generations[0] else None
+        output = ""
+        if generation is not None:
+            output = generation.text + _function_call(getattr(generation, "message", None))
+
+        fields = {"completion_tokens": count_tokens(output)}
+        # The API usage, only returned when the call wasn't streamed, is exact
+        usage = (response.llm_output or {}).get("token_usage") or {}
+        fields.update({key: usage[key] for key in ("prompt_tokens", "completion_tokens") if key in usage})
+        with self._lock:
+            prompt_tokens = fields.get("prompt_tokens", self._open.get(run_id, {}).get("prompt_tokens", 0))
+        self._end(run_id, output, total_tokens=prompt_tokens + fields["completion_tokens"], **fields)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._end(run_id, error=error)
+
+    # Tool calls
+
+    def on_tool_start(self, serialized: Dict[str, Any], input_str: str, *, run_id, **kwargs):
+        self._start(run_id, "tool", serialized.get("name", "tool"), input_str)
+
+    def on_tool_end(self, output, *, run_id, **kwargs):
+        self._end(run_id, str(output))
+
+    def on_tool_error(self, error, *, run_id, **kwargs):
+        self._end(run_id, error=error)
+
+    # Retriever calls
+
+    def on_retriever_start(self, serialized: Dict[str, Any], query: str, *, run_id, **kwargs):
+        self._start(run_id, "retriever", serialized.get("id", ["retriever"])[-1], query)
+
+    def on_retriever_end(self, documents, *, run_id, **kwargs):
+        self._end(run_id, "".join(document.page_content for document in documents), documents=len(documents))
+
+    def on_retriever_error(self, error, *, run_id, **kwargs):
+        self._end(run_id, error=error)
@@ -0,0 +1,192 @@
+import hmac
+import os
+import sqlite3
+import threading
+import pandas as pd
+from webpages.pages_util.util import CUSTOMER_DATA_PATH, USER_STORE_PATH
+
+# Field of the user data shown in the app: column of the users table
+COLUMNS = {"Email": "email", "Full Name": "full_name", "Username": "username", "Password": "password", "Age": "age",
+           "Location": "location", "Bot Preferences": "bot_preferences"}
+# Field order of the user data kept in the session, which never holds the password
+USER_DATA_FIELDS = ["Email", "Username", "Full Name", "Age", "Location", "Bot Preferences"]
+
+# Some accounts of customer_data.csv share an email, so its uniqueness is only enforced for new users and edits
+SCHEMA = ["""
+CREATE TABLE IF NOT EXISTS users (
+    username TEXT PRIMARY KEY,
+    email TEXT NOT NULL,
+    full_name TEXT,
+    password TEXT NOT NULL,
+    age INTEGER,
+    location TEXT,
+    bot_preferences TEXT
+)
+""", "CREATE INDEX IF NOT EXISTS users_email ON users (email)"]
+# PRAGMA user_version once the schema is created and customer_data.csv imported
+SCHEMA_VERSION = 1
+
+
+class UserExistsError(Exception):
+    """Raised when a signup or a profile edit would reuse another user's username or email."""
+
+    def __init__(self, field):
+        super().__init__(f"{field} is already taken")
+        self.field = field
+
+
+class DuplicateUsernameError(Exception):
+    """Raised when customer_data.csv lists a username more than once, the migration is aborted."""
+
+    def __init__(self, usernames):
+        super().__init__(f"customer_data.csv lists these usernames more than once: {', '.join(usernames)}")
+        self.usernames = usernames
+
+
+class UserStore:
+    """
+    Users of the app in an SQLite database (WAL mode): lookups by username or email use the table's indexes and
+    signups and profile edits write a single row in a transaction, so concurrent sessions never overwrite each
+    other. On first use the database is filled from customer_data.csv, keeping every account.
+    """
+
+    def __init__(self, path=USER_STORE_PATH, csv_path=CUSTOMER_DATA_PATH):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        # Writers of other processes are waited for instead of failing with "database is locked"
+        self._db.execute("PRAGMA busy_timeout=5000")
+        self._lock = threading.Lock()
+
+        with self._lock:
+            if self._db.execute("PRAGMA user_version").fetchone()[0] < SCHEMA_VERSION:
+                self._db.execute("BEGIN IMMEDIATE")
+                try:
+                    # Checked again inside the transaction, another process may have migrated in the meantime
+                    if self._db.execute("PRAGMA user_version").fetchone()[0] < SCHEMA_VERSION:
+                        # One statement at a time, executescript would commit the migration transaction
+                        for statement in SCHEMA:
+                            self._db.execute(statement)
+                        if csv_path and os.path.exists(csv_path):
+                            self._import_csv(csv_path)
+                        self._db.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+                    self._db.execute("COMMIT")
+                except Exception:
+                    self._db.execute("ROLLBACK")
+                    raise
+
+    def _import_csv(self, csv_path):
+        users = pd.read_csv(csv_path, usecols=list(COLUMNS), dtype={"Age": "Int64"}).rename(columns=COLUMNS)
+        duplicated = users["username"][users["username"].duplicated()]
+        if not duplicated.empty:
+            raise DuplicateUsernameError(sorted(set(duplicated.astype(str))))
+
+        users = users.astype(object).where(users.notna(), None)
+        columns = list(COLUMNS.values())
+        # A row missing a mandatory field fails the whole migration instead of being skipped
+        self._db.executemany(f"INSERT INTO users ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})",
+                             users[columns].itertuples(index=False, name=None))
+
+    @staticmethod
+    def _user_data(row):
+        user = dict(zip(COLUMNS, row))
+        return {field: user[field] for field in USER_DATA_FIELDS}
+
+    def _select(self, where, value):
+        with self._lock:
+            return self._db.execute(f"SELECT {', '.join(COLUMNS.values())} FROM users WHERE {where} = ?",
+                                    (value,)).fetchone()
+
+    def get(self, username):
+        """User data of a username, or None."""
+        row = self._select("username", username)
+        return self._user_data(row) if row else None
+
+    def get_by_email(self, email):
+        """User data of an email (the first account imported with it, for the few that share one), or None."""
+        row = self._select("email", email)
+        return self._user_data(row) if row else None
+
+    def authenticate(self, username, password):
+        """User data of the username if the password matches, otherwise None."""
+        row = self._select("username", username)
+        if row is None or not hmac.compare_digest(password, row[list(COLUMNS).index("Password")]):
+            return None
+        return self._user_data(row)
+
+    def _check_email(self, email, username=None):
+        """Raise UserExistsError if the email belongs to a user other than username, to run in a write transaction."""
+        if username is not None:
+            row = self._db.execute("SELECT email FROM users WHERE username = ?", (username,)).fetchone()
+            # Keeping the email an imported account shares with another one is allowed
+            if row is not None and row[0] == email:
+                return
+        if self._db.execute("SELECT 1 FROM users WHERE email = ? AND username IS NOT ?",
+                            (email, username)).fetchone():
+            raise UserExistsError("Email")
+
+    def _write(self, statement, values, email=None, username=None):
+        """Run a write statement in a transaction, checking first that the email (if given) isn't another user's."""
+        with self._lock:
+            try:
+                self._db.execute("BEGIN IMMEDIATE")
+                if email is not None:
+                    self._check_email(email, username)
+                cursor = self._db.execute(statement, values)
+                self._db.execute("COMMIT")
+            except sqlite3.IntegrityError as e:
+                self._db.execute("ROLLBACK")
+                # "UNIQUE constraint failed: users.username", other failures (e.g. NOT NULL) aren't a taken value
+                if not str(e).startswith("UNIQUE constraint failed"):
+                    raise
+                column = str(e).rsplit(".", 1)[-1]
+                raise UserExistsError(next((field for field, name in COLUMNS.items() if name == column),
+                                           column)) from e
+            except Exception:
+                if self._db.in_transaction:
+                    self._db.execute("ROLLBACK")
+                raise
+            return cursor.rowcount
+
+    def create(self, user):
+        """Add a user (all the fields of COLUMNS), raise UserExistsError if the username or email is taken."""
+        columns = list(COLUMNS.values())
+        self._write(f"INSERT INTO users ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})",
+                    [user.get(field) for field in COLUMNS], email=user.get("Email"))
+
+    def update(self, username, user_data, new_password=None):
+        """
+        Overwrite the fields of a user with the given user data, and the password when a new one is given. Return
+        whether the user exists, raise UserExistsError if the new username or email is another user's.
+        """
+        fields = [field for field in user_data if field in COLUMNS and field != "Password"]
+        values = [user_data[field] for field in fields]
+        if new_password:
+            fields.append("Password")
+            values.append(new_password)
+        assignments = ", ".join(f"{COLUMNS[field]} = ?" for field in fields)
+        return self._write(f"UPDATE users SET {assignments} WHERE username = ?", values + [username],
+                           email=user_data.get("Email"), username=username) == 1
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM users").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+_user_store = None
+_user_store_lock = threading.Lock()
+
+
+def get_user_store():
+    """Return the process-wide user store."""
+    global _user_store
+    if _user_store is None:
+        with _user_store_lock:
+            if _user_store is None:
+                _user_store = UserStore()
+    return _user_store
@@ -1,7 +1,45 @@
+import hashlib
+import os
 import re
 
 CUSTOMER_DATA_PATH = "webpages/pages_util/customer_data.csv"
-DATASET_PATH = "webpages/pages_util/car_dataset.csv"
+# SQLite database of the users, filled from CUSTOMER_DATA_PATH on first use (see user_store.py)
+USER_STORE_PATH = os.environ.get("AUTOMENTOR_USER_STORE_PATH", "webpages/pages_util/users.sqlite")
+DATASET_PATH = os.environ.get("AUTOMENTOR_DATASET_PATH", "webpages/pages_util/car_dataset.csv")
+# Typed columnar export of the dataset written by data_generators/webscrapers/preprocess.py
+DATASET_COLUMNAR_PATH = os.path.splitext(DATASET_PATH)[0] + ".feather"
+# Columns and unique categorical values of the dataset, built along with it
+DATASET_CATALOGUE_PATH = os.path.splitext(DATASET_PATH)[0] + "_catalogue.json"
+APPRAISAL_MODELS_DIR = os.environ.get("AUTOMENTOR_APPRAISAL_MODELS_DIR", "webpages/pages_util/appraisal_models")
+# On-disk cache of the numba functions compiled by umap, so a restarted server or a new appraisal worker loads them
+# instead of compiling them again (see warmup.py)
+NUMBA_CACHE_DIR = os.environ.get("AUTOMENTOR_NUMBA_CACHE_DIR", "webpages/pages_util/numba_cache")
+# Resized listing photos, see photo_cache.py
+PHOTO_CACHE_DIR = os.environ.get("AUTOMENTOR_PHOTO_CACHE_DIR", "webpages/pages_util/photo_cache")
+# FAISS index of the car brand curiosities, built by data_generators/vectordatabase/generate_vectordb.py
+VECTORSTORE_PATH = "./webpages/pages_util/FAISS_car_brands_curiosities"
+# SQLite file of the query embeddings already computed, an empty value keeps them in memory only
+EMBEDDING_CACHE_PATH = os.environ.get("AUTOMENTOR_EMBEDDING_CACHE_PATH", "webpages/pages_util/embedding_cache.sqlite")
+# Spans of the agent's LLM, tool and retriever calls, see tracing.py, an empty value disables the file
+TRACE_PATH = os.environ.get("AUTOMENTOR_TRACE_PATH", "webpages/pages_util/traces.jsonl")
+# SQLite file of the LLM response cache, see response_cache.py
+RESPONSE_CACHE_PATH = os.environ.get("AUTOMENTOR_RESPONSE_CACHE_PATH", "webpages/pages_util/response_cache.sqlite")
+
+
+def dataset_path():
+    # Prefer the columnar export, unless the CSV was rewritten after it
+    if os.path.exists(DATASET_COLUMNAR_PATH):
+        if not os.path.exists(DATASET_PATH) or os.path.getmtime(DATASET_COLUMNAR_PATH) >= os.path.getmtime(DATASET_PATH):
+            return DATASET_COLUMNAR_PATH
+    return DATASET_PATH
+
+
+def dataset_version(path=None):
+    # Cheap fingerprint of the dataset file, changes whenever the file is rewritten
+    path = path or dataset_path()
+    stat = os.stat(path)
+    fingerprint = f"{os.path.abspath(path)}:{stat.st_size}:{stat.st_mtime_ns}"
+    return hashlib.sha1(fingerprint.encode()).hexdigest()[:12]
 
 
 def extract_listing_ids(input_string):
@@ -32,7 +70,7 @@ def generate_markdown_table(df, index_list):
 
     # Merge 'Brand' and 'Model' into a single column 'Car' in the photo DataFrame
     photo_df = df.loc[index_list][['Brand', 'Model', 'Photo']]
-    photo_df['Car'] = '#' + photo_df.index.astype(str) + ' ' + photo_df['Brand'] + ' ' + photo_df['Model']
+    photo_df['Car'] = '#' + photo_df.index.astype(str) + ' ' + photo_df['Brand'].astype(str) + ' ' + photo_df['Model'].astype(str)
 
     photo_df = photo_df[['Car', 'Photo']].reset_index(drop=True)
 
@@ -0,0 +1,175 @@
+import copy
+import hashlib
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import List, Optional
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from langchain_openai import OpenAIEmbeddings
+from webpages.pages_util.util import EMBEDDING_CACHE_PATH, VECTORSTORE_PATH
+
+EMBEDDING_CACHE_MAX_ENTRIES = 1024
+# Embedding models kept for the API keys of the sessions, one per key
+EMBEDDING_MODELS_MAX = 64
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Embeddings with an in-memory LRU cache and an optional SQLite cache in front of the model.
+
+    The model (OpenAIEmbeddings by default) is only created on the first cache miss, so a process answering from the
+    cache never needs the API. Each user brings their own API key: with_api_key returns embeddings sharing this cache
+    whose misses are embedded (and billed) with that key.
+    """
+
+    def __init__(self, factory=OpenAIEmbeddings, path=EMBEDDING_CACHE_PATH, max_entries=EMBEDDING_CACHE_MAX_ENTRIES,
+                 namespace="text-embedding-ada-002"):
+        self.factory = factory
+        self.max_entries = max_entries
+        self.namespace = namespace
+        # None embeds with the OPENAI_API_KEY of the environment
+        self.api_key = None
+        # API key -> model, shared with the embeddings returned by with_api_key
+        self._models = OrderedDict()
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()
+        self._counts = {"hits": 0, "misses": 0}
+
+        self._db = None
+        if path:
+            if os.path.dirname(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+            self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB)")
+
+    def with_api_key(self, api_key):
+        """Embeddings sharing this cache, calling the model with the given API key on a miss."""
+        embeddings = copy.copy(self)
+        embeddings.api_key = api_key
+        return embeddings
+
+    @property
+    def model(self):
+        with self._lock:
+            model = self._models.get(self.api_key)
+            if model is None:
+                model = self.factory() if self.api_key is None else self.factory(openai_api_key=self.api_key)
+                self._models[self.api_key] = model
+                if len(self._models) > EMBEDDING_MODELS_MAX:
+                    self._models.popitem(last=False)
+            self._models.move_to_end(self.api_key)
+        return model
+
+    @property
+    def hits(self):
+        return self._counts["hits"]
+
+    @property
+    def misses(self):
+        return self._counts["misses"]
+
+    def _key(self, text):
+        return hashlib.sha256(f"{self.namespace}\x00{' '.join(text.split())}".encode()).hexdigest()
+
+    def _get(self, key):
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                return self._memory[key]
+            row = self._db.execute("SELECT vector FROM embeddings WHERE key = ?", (key,)).fetchone() \
+                if self._db is not None else None
+        if row is None:
+            return None
+        vector = np.frombuffer(row[0], dtype=np.float64).tolist()
+        self._put(key, vector, persist=False)
+        return vector
+
+    def _put(self, key, vector, persist=True):
+        with self._lock:
+            self._memory[key] = vector
+            self._memory.move_to_end(key)
+            if len(self._memory) > self.max_entries:
+                self._memory.popitem(last=False)
+            if persist and self._db is not None:
+                self._db.execute("INSERT OR REPLACE INTO embeddings VALUES (?, ?)",
+                                 (key, np.asarray(vector, dtype=np.float64).tobytes()))
+
+    def _count(self, hits=0, misses=0):
+        with self._lock:
+            self._counts["hits"] += hits
+            self._counts["misses"] += misses
+
+    def cached_query(self, text: str) -> Optional[List[float]]:
+        """The embedding of a query if it is in the cache, without ever calling the model."""
+        return self._get(self._key(text))
+
+    def embed_query(self, text: str) -> List[float]:
+        key = self._key(text)
+        vector = self._get(key)
+        if vector is not None:
+            self._count(hits=1)
+            return vector
+        self._count(misses=1)
+        vector = self.model.embed_query(text)
+        self._put(key, vector)
+        return vector
+
+    async def aembed_query(self, text: str) -> List[float]:
+        key = self._key(text)
+        vector = self._get(key)
+        if vector is not None:
+            self._count(hits=1)
+            return vector
+        self._count(misses=1)
+        vector = await self.model.aembed_query(text)
+        self._put(key, vector)
+        return vector
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys = [self._key(text) for text in texts]
+        vectors = [self._get(key) for key in keys]
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+        self._count(hits=len(texts) - len(missing), misses=len(missing))
+        if missing:
+            for i, vector in zip(missing, self.model.embed_documents([texts[i] for i in missing])):
+                vectors[i] = vector
+                self._put(keys[i], vector)
+        return vectors
+
+    def __str__(self):
+        return f"{self.hits} hits / {self.misses} misses"
+
+
+_embeddings = None
+_vectorstore = None
+_vectorstore_lock = threading.Lock()
+
+
+def get_embeddings(api_key=None):
+    """
+    Return the process-wide cached embeddings, with the misses embedded using api_key (the OPENAI_API_KEY of the
+    environment if None).
+    """
+    global _embeddings
+    if _embeddings is None:
+        with _vectorstore_lock:
+            if _embeddings is None:
+                _embeddings = CachedEmbeddings()
+    return _embeddings if api_key is None else _embeddings.with_api_key(api_key)
+
+
+def get_vectorstore():
+    """Return the car brand curiosities FAISS index, loaded once per process and only read by the sessions."""
+    global _vectorstore
+    embeddings = get_embeddings()
+    if _vectorstore is None:
+        with _vectorstore_lock:
+            if _vectorstore is None:
+                # Loads faiss, only needed once a session retrieves brand information
+                from langchain.vectorstores import FAISS
+
+                _vectorstore = FAISS.load_local(VECTORSTORE_PATH, embeddings)
+    return _vectorstore
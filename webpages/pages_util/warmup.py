@@ -0,0 +1,128 @@
+import os
+import threading
+import time
+from webpages.pages_util.util import NUMBA_CACHE_DIR
+
+# numba reads its cache location when it is first imported (by umap), this module is imported before that
+os.environ.setdefault("NUMBA_CACHE_DIR", os.path.abspath(NUMBA_CACHE_DIR))
+
+WARMUP_ENABLED = os.environ.get("AUTOMENTOR_WARMUP", "1") == "1"
+
+
+def _load_listings():
+    from webpages.pages_util.catalogue import get_catalogue
+    from webpages.pages_util.listing_store import get_listing_store
+
+    get_listing_store()
+    get_catalogue()
+
+
+def _load_brand_index():
+    from webpages.pages_util.lexical import get_lexical_index
+    from webpages.pages_util.vectorstore import get_vectorstore
+
+    get_lexical_index(get_vectorstore())
+
+
+def _start_appraisal_pool():
+    from webpages.pages_util.appraisal_pool import appraisal_pool
+
+    # The appraisals run in the pool workers, which load the listings and compile umap's numba functions in their
+    # initializer. Compiling in this process would also need umap's parallel functions to run on this thread, and
+    # numba's tbb/omp layers then hang the interpreter's exit.
+    errors = [error for _, error, _ in (future.result() for future in appraisal_pool.start()) if error is not None]
+    if errors:
+        raise RuntimeError(f"{len(errors)} appraisal workers failed to warm up: {errors[0]}")
+
+
+def _start_repl_pool():
+    from webpages.pages_util.repl_pool import repl_pool
+
+    repl_pool.start()
+
+
+# The chat needs the listings and the brand index first
+WARMUP_STAGES = [("listings", _load_listings),
+                 ("brand index", _load_brand_index),
+                 ("python workers", _start_repl_pool),
+                 ("appraisal workers", _start_appraisal_pool)]
+
+
+class Warmup:
+    """
+    Loads the shared resources and compiles the appraisal code once per server process, on a background thread, so
+    the first user doesn't wait for it. A failed stage is only recorded, its resources are loaded on first use as
+    without warm-up.
+    """
+
+    def __init__(self, stages=WARMUP_STAGES):
+        self.stages = stages
+        self.status = {name: "pending" for name, _ in stages}
+        self.durations = {}
+        self.errors = {}
+        self.started = None
+        self.finished = None
+        self._done = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self.started = time.perf_counter()
+            self._thread = threading.Thread(target=self._run, name="warm-up", daemon=True)
+            self._thread.start()
+        return self
+
+    def _run(self):
+        try:
+            for name, stage in self.stages:
+                self.status[name] = "running"
+                start = time.perf_counter()
+                try:
+                    stage()
+                    self.status[name] = "done"
+                except Exception as e:
+                    self.status[name] = "failed"
+                    self.errors[name] = repr(e)
+                self.durations[name] = time.perf_counter() - start
+        finally:
+            self.finished = time.perf_counter()
+            self._done.set()
+
+    @property
+    def ready(self):
+        return self._done.is_set()
+
+    def wait(self, timeout=None):
+        """Block until every stage ran, return whether it did within the timeout."""
+        return self._done.wait(timeout)
+
+    def stats(self):
+        """Status and duration in seconds of each stage."""
+        return {name: {"status": self.status[name],
+                       "seconds": self.durations.get(name),
+                       "error": self.errors.get(name)} for name, _ in self.stages}
+
+    def __str__(self):
+        if self._thread is None:
+            return "not started"
+        if not self.ready:
+            done = sum(status == "done" for status in self.status.values())
+            running = next((name for name, status in self.status.items() if status == "running"), "")
+            return f"warming up {running} ({done}/{len(self.stages)})"
+        failed = [name for name, status in self.status.items() if status == "failed"]
+        summary = f"ready in {self.finished - self.started:.1f} s"
+        return f"{summary}, failed: {', '.join(failed)}" if failed else summary
+
+
+_warmup = None
+_warmup_lock = threading.Lock()
+
+
+def get_warmup():
+    """Return the warm-up of the server process, starting it on the first call."""
+    global _warmup
+    if _warmup is None:
+        with _warmup_lock:
+            if _warmup is None:
+                _warmup = Warmup().start()
+    return _warmup